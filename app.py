@@ -1,47 +1,77 @@
-from flask import Flask, render_template, url_for, request, jsonify, session
+from flask import Flask, render_template, url_for, request, jsonify, session, Response, stream_with_context
 import json
 import os
 import calculations
 from livereload import Server
 from calculations.calculations import CALC_REGISTRY
 from dotenv import load_dotenv
-import requests
+import http_client
+import auth_cache
 import firebase_admin
 import tempfile
+import hashlib
+import time
+import uuid
 from werkzeug.utils import secure_filename
-from firebase_admin import credentials, auth as firebase_auth
-from PIL import Image
-import pytesseract
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge, ServiceUnavailable
 from health_assistant import (
     check_environment_variables,
     process_document_file,
     analyze_document_with_gpt,
     process_user_request,
+    process_user_request_stream,
     chat_with_bot
 )
 import firebase_admin
 from firebase_admin import credentials, firestore
-
-# Load Azure Health Text Analytics configuration from environment
-AZURE_HEALTH_ENDPOINT = os.environ.get("AZURE_HEALTH_ENDPOINT")
-AZURE_HEALTH_KEY = os.environ.get("AZURE_HEALTH_KEY")
-
+from cache import tiered_cache
+import firestore as firestore_store
+from conversation_store import conversation_store
+from policy_index import policy_index
+import document_cache
+import document_pipeline
+import uploads
+from job_queue import job_queue, DONE, FAILED
+from singleflight import SingleFlight
+import outbound_scheduler
+from outbound_scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, SchedulerSaturated
 
 cred = credentials.Certificate("firebase-key.json")
 firebase_admin.initialize_app(cred)
 
 db = firestore.client()
 
+# Keep Google's token signing keys warm so logins never wait on a key fetch.
+auth_cache.signing_keys.start_background_refresh()
+
 app = Flask(__name__) 
 
 app.config['TEMPLATES_AUTO_RELOAD'] = True
+# Uploaded files are spooled in bounded buffers with size limits (see uploads.py).
+uploads.init_app(app)
 
 load_dotenv()
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+GEMINI_MODEL_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash"
 
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret")
 
+# Concurrent identical explanation requests share one Gemini call.
+upstream_calls = SingleFlight()
+
+# Explanations are cached on their normalized prompt inputs. Set
+# EXPLAIN_CACHE_RESULT_DIGITS to bucket results to that many significant digits.
+EXPLAIN_CACHE_TTL = int(os.environ.get("EXPLAIN_CACHE_TTL", 7 * 24 * 3600))
+EXPLAIN_CACHE_RESULT_DIGITS = os.environ.get("EXPLAIN_CACHE_RESULT_DIGITS")
+explain_cache = tiered_cache(
+    "explain",
+    ttl=EXPLAIN_CACHE_TTL,
+    memory_entries=int(os.environ.get("EXPLAIN_CACHE_MEMORY_ENTRIES", 512)),
+    max_entries=int(os.environ.get("EXPLAIN_CACHE_MAX_ENTRIES", 20000)),
+    max_bytes=int(os.environ.get("EXPLAIN_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
 
 json_path = os.path.join(app.root_path, 'data', 'calculations.json')
 with open(json_path, encoding='utf-8') as f:
@@ -77,7 +107,7 @@ def login():
 
     id_token = auth_header.split(" ")[1]
     try:
-        decoded = firebase_auth.verify_id_token(id_token)
+        decoded = auth_cache.verify_id_token(id_token)
         uid = decoded['uid']
         session.permanent = True  # Optional
         session['user'] = uid
@@ -89,6 +119,120 @@ def login():
 
 
 
+def wants_event_stream(req_data):
+    return bool(req_data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
+
+
+def sse_event(payload, event=None):
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(payload)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def event_stream_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def scheduled_event_stream(upstream, priority, events):
+    # The slot is taken before the response starts so saturation still maps to 429/503,
+    # and released once the WSGI server closes the streamed response.
+    limiter = outbound_scheduler.limiter(upstream)
+    limiter.acquire(priority)
+    started = time.monotonic()
+    response = event_stream_response(events)
+    response.call_on_close(lambda: limiter.release(time.monotonic() - started))
+    return response
+
+
+@app.errorhandler(RequestEntityTooLarge)
+@app.errorhandler(ServiceUnavailable)
+def upload_rejected(e):
+    # Raised by the upload buffers and size limits; the upload forms read JSON back.
+    return jsonify({'error': e.description}), e.code
+
+
+@app.errorhandler(SchedulerSaturated)
+def outbound_saturated(e):
+    response = jsonify({'error': str(e)})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+def stream_gemini(prompt):
+    url = f"{GEMINI_MODEL_URL}:streamGenerateContent?alt=sse&key={GEMINI_API_KEY}"
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}]
+    }
+    with http_client.post("gemini", url, json=payload, stream=True, idempotent=True) as response:
+        response.raise_for_status()
+        response.encoding = 'utf-8'
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = json.loads(line[len('data:'):].strip())
+            for candidate in chunk.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+
+
+def explanation_events(prompt, cache_key):
+    parts = []
+    try:
+        for text in stream_gemini(prompt):
+            parts.append(text)
+            yield sse_event({"delta": text})
+    except Exception as e:
+        print("Gemini stream error:", e)
+        yield sse_event({"explanation": "Sorry, could not get explanation."}, event="error")
+        return
+    explanation = "".join(parts)
+    if explanation:
+        explain_cache.set(cache_key, explanation)
+    else:
+        explanation = "Sorry, could not get explanation."
+    yield sse_event({"explanation": explanation}, event="done")
+
+
+def _normalize_explain_value(value, digits=None):
+    if isinstance(value, str):
+        stripped = value.strip()
+        try:
+            value = float(stripped)
+        except ValueError:
+            return " ".join(stripped.lower().split())
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        value = float(value)
+        if digits:
+            value = float(f"{value:.{int(digits)}g}")
+        return repr(value)
+    return value
+
+
+def explain_cache_key(calc_name, result, unit, age, sex, race, additional_context, parameters):
+    key_data = {
+        "calc_name": calc_name,
+        "result": _normalize_explain_value(result, EXPLAIN_CACHE_RESULT_DIGITS),
+        "unit": unit,
+        "age": _normalize_explain_value(age),
+        "sex": _normalize_explain_value(sex),
+        "race": _normalize_explain_value(race),
+        "additional_context": _normalize_explain_value(additional_context),
+        "parameters": sorted(
+            (str(k), _normalize_explain_value(v)) for k, v in parameters.items()
+        ),
+    }
+    raw = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
 @app.route('/explain', methods=['POST'])
 def explain():
     req_data = request.get_json()
@@ -148,24 +292,58 @@ Unit: {unit}
 {param_str}
 
 Please provide your explanation now:"""
-    
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
+    cache_key = explain_cache_key(
+        calc_name, result, unit, age, sex, race, additional_context, parameters
+    )
+    cached = explain_cache.get(cache_key)
+    if wants_event_stream(req_data):
+        if cached:
+            return event_stream_response(iter([
+                sse_event({"delta": cached}),
+                sse_event({"explanation": cached}, event="done")
+            ]))
+        return scheduled_event_stream("gemini", PRIORITY_INTERACTIVE, explanation_events(prompt, cache_key))
+    if cached:
+        return jsonify({"explanation": cached})
+
+    url = f"{GEMINI_MODEL_URL}:generateContent?key={GEMINI_API_KEY}"
     payload = {
         "contents": [{"parts": [{"text": prompt}]}]
     }
-    try:
-        response = requests.post(url, json=payload)
+    def generate_explanation():
+        with outbound_scheduler.slot("gemini", PRIORITY_INTERACTIVE):
+            response = http_client.post("gemini", url, json=payload, idempotent=True)
         print("Gemini response:", response.status_code, response.text)
-        explanation = "Sorry, could not get explanation."
-        if response.ok:
-            explanation = response.json()['candidates'][0]['content']['parts'][0]['text']
-        return jsonify({"explanation": explanation})
+        if not response.ok:
+            return None
+        explanation = response.json()['candidates'][0]['content']['parts'][0]['text']
+        explain_cache.set(cache_key, explanation)
+        return explanation
+
+    try:
+        explanation = upstream_calls.do(f"gemini:{cache_key}", generate_explanation)
+        return jsonify({"explanation": explanation or "Sorry, could not get explanation."})
+    except SchedulerSaturated:
+        raise
     except Exception as e:
         print("Gemini error:", e)
         return jsonify({"explanation": "Sorry, could not get explanation."})
 
 
+@app.route('/health/upstreams')
+def upstream_health():
+    return jsonify({
+        "upstreams": http_client.upstream_metrics(),
+        "coalesced_calls": upstream_calls.stats(),
+        "scheduler": outbound_scheduler.scheduler_stats()
+    })
+
+
+@app.route('/health/policy-index')
+def policy_index_health():
+    return jsonify(policy_index.stats())
+
 @app.route('/')
 def index():
      cards = data['categories']
@@ -258,9 +436,8 @@ def dashboard():
     if not uid:
         return "Unauthorized", 401
 
-    # Fetch user info from Firestore
-    user_doc = db.collection("users").document(uid).get()
-    user_info = user_doc.to_dict() if user_doc.exists else {}
+    # Fetch user info from Firestore (cached)
+    user_info = firestore_store.get_user(uid)
     display_name = user_info.get("displayName", "User")
 
     return render_template("dashboard.html", user=display_name)
@@ -285,77 +462,245 @@ def policyai():
 
 @app.route('/chat/health-assistant', methods=['POST'])
 def health_assistant_chat():
-    if not session.get('user'):
+    uid = session.get('user')
+    if not uid:
         return jsonify({'error': 'Unauthorized'}), 401
         
     try:
         data = request.get_json()
         user_message = data.get('message')
-        conversation = data.get('conversation', [])
         doc_summary = data.get('doc_summary')
         
         if not user_message:
             return jsonify({'error': 'Message is required'}), 400
-            
-        reply = process_user_request(user_message, conversation, doc_summary)
+
+        # History lives server-side; the client only sends the chat ID and the new message.
+        conversation = conversation_store.open(data.get('chat_id'), uid)
+        if conversation is None:
+            return jsonify({'error': 'Chat not found'}), 404
+        history = conversation.history()
+
+        if wants_event_stream(data):
+            def events():
+                parts = []
+                for text in process_user_request_stream(user_message, history, doc_summary, conversation.summary, uid):
+                    parts.append(text)
+                    yield sse_event({'delta': text})
+                reply = "".join(parts)
+                conversation_store.append_turn(conversation, user_message, reply)
+                yield sse_event({
+                    'response': reply,
+                    'chat_id': conversation.chat_id
+                }, event='done')
+            return scheduled_event_stream("azure_openai", PRIORITY_INTERACTIVE, events())
+
+        with outbound_scheduler.slot("azure_openai", PRIORITY_INTERACTIVE):
+            reply = process_user_request(user_message, history, doc_summary, conversation.summary, uid)
+        conversation_store.append_turn(conversation, user_message, reply)
         
         return jsonify({
             'response': reply,
-            'conversation': conversation + [
-                {'role': 'user', 'content': user_message},
-                {'role': 'assistant', 'content': reply}
-            ]
+            'chat_id': conversation.chat_id
         })
-        
+
+    except SchedulerSaturated:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/chat/<chat_id>/messages')
+def chat_messages(chat_id):
+    uid = session.get('user')
+    if not uid:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if firestore_store.get_chat_owner(chat_id) != uid:
+        return jsonify({'error': 'Chat not found'}), 404
+    try:
+        after = request.args.get('after')
+        if after is not None:
+            messages, cursor = firestore_store.get_messages_since(chat_id, after or None)
+            return jsonify({'messages': messages, 'cursor': cursor})
+        limit = request.args.get('limit', firestore_store.HISTORY_PAGE_SIZE, type=int)
+        before = request.args.get('before')
+        messages, next_cursor = firestore_store.get_messages(chat_id, limit, before)
+        payload = {'messages': messages, 'next_cursor': next_cursor}
+        if not before:
+            # Starting point for delta polling with ?after=
+            payload['latest_cursor'] = firestore_store.encode_cursor(messages[0]) if messages else ''
+        return jsonify(payload)
+    except (ValueError, KeyError):
+        return jsonify({'error': 'Invalid cursor'}), 400
+
 @app.route("/health-assistant/upload", methods=["POST"])
 def upload_document():
     try:
-        if "file" not in request.files:
+        files = request.files.getlist("file")
+        if not files:
             return jsonify({"error": "No file uploaded"}), 400
-        file = request.files["file"]
-        if not file.filename:
-            return jsonify({"error": "Empty filename"}), 400
-
-        filename = secure_filename(file.filename)
-        # Save to temp file for OCR or direct text extraction
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            file.save(tmp.name)
-            tmp.flush()
-            # Basic type check
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                # OCR for images
-                text = pytesseract.image_to_string(Image.open(tmp.name))
-            elif filename.lower().endswith('.txt'):
-                with open(tmp.name, "r", encoding="utf-8") as f:
-                    text = f.read()
-            else:
-                return jsonify({"error": "Unsupported file type"}), 400
-
-        # Call Azure Health Text Analytics
-        url = f"{AZURE_HEALTH_ENDPOINT}/text/analytics/v3.1/entities/health"
-        headers = {
-            "Ocp-Apim-Subscription-Key": AZURE_HEALTH_KEY,
-            "Content-Type": "application/json"
-        }
-        data = {
-            "documents": [
-                {"id": "1", "language": "en", "text": text}
-            ]
-        }
-        resp = requests.post(url, headers=headers, json=data)
-        if resp.status_code != 200:
-            return jsonify({"error": f"Azure error {resp.status_code}: {resp.text}"}), 500
-        result = resp.json()
-        # You can summarize or just send entities
-        entities = result["documents"][0].get("entities", [])
-        summary = "; ".join([f"{e['category']}: {e['text']}" for e in entities]) if entities else "No medical entities found."
-
-        return jsonify({"success": True, "doc_summary": summary})
+        if len(files) > document_pipeline.UPLOAD_MAX_FILES:
+            return jsonify({"error": f"Upload at most {document_pipeline.UPLOAD_MAX_FILES} files at once"}), 400
+        filenames = []
+        for file in files:
+            if not file.filename:
+                return jsonify({"error": "Empty filename"}), 400
+            filename = secure_filename(file.filename)
+            if not document_pipeline.is_supported_upload(filename):
+                return jsonify({"error": f"Unsupported file type: {filename}"}), 400
+            filenames.append(filename)
+
+        # Results are cached on the files' content hashes; a repeat upload returns straight away.
+        digests = [document_cache.file_digest(file.stream) for file in files]
+        digest = document_pipeline.bundle_digest(digests)
+        cached = document_cache.get(digest)
+        if "doc_summary" in cached:
+            return jsonify({"success": True, "doc_summary": cached["doc_summary"]})
+
+        # Extraction and entity analysis run in a worker process; the client follows the job.
+        # A repeat of an upload still in progress follows the job already queued for it.
+        job_id = job_queue.find_active("document_upload", digest, session.get('user'))
+        if job_id:
+            return _job_accepted(job_id)
+        sizes = []
+        for file in files:
+            file.stream.seek(0, os.SEEK_END)
+            sizes.append(file.stream.tell())
+            file.stream.seek(0)
+        # The copies wait on disk for a worker, so they count against the upload disk budget.
+        uploads.check_disk_budget(sum(sizes), job_queue.pending_file_bytes())
+        job_id = job_queue.new_id()
+        saved = []
+        try:
+            for index, (file, filename, file_digest) in enumerate(zip(files, filenames, digests)):
+                path = job_queue.file_path(f"{job_id}-{index}", os.path.splitext(filename)[1].lower())
+                file.save(path)
+                saved.append({"path": path, "filename": filename, "digest": file_digest})
+            job_queue.enqueue(
+                "document_upload",
+                {"files": saved, "digest": digest},
+                owner_uid=session.get('user'),
+                job_id=job_id,
+                dedupe_key=digest,
+                file_bytes=sum(sizes),
+            )
+        except Exception:
+            for upload in saved:
+                os.remove(upload["path"])
+            raise
+        return _job_accepted(job_id)
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+def _job_accepted(job_id):
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for('job_status', job_id=job_id),
+        "events_url": url_for('job_events', job_id=job_id)
+    }), 202
+
+def _visible_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None or (job["owner_uid"] and job["owner_uid"] != session.get('user')):
+        return None
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"] if job["status"] == FAILED else None,
+        "attempts": job["attempts"]
+    }
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+JOB_EVENTS_POLL_INTERVAL = 0.5
+# Each stream holds a sync web worker, so it ends well inside gunicorn's 30 s worker
+# timeout; clients reconnect after JOB_EVENTS_RETRY_MS or fall back to polling /jobs/<id>.
+JOB_EVENTS_TIMEOUT = int(os.environ.get("JOB_EVENTS_TIMEOUT", 20))
+JOB_EVENTS_RETRY_MS = int(os.environ.get("JOB_EVENTS_RETRY_MS", 2000))
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def events(job):
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        last_status = None
+        yield f"retry: {JOB_EVENTS_RETRY_MS}\n\n"
+        while True:
+            if job["status"] in (DONE, FAILED):
+                yield sse_event(job, event='done')
+                return
+            if job["status"] != last_status:
+                yield sse_event(job, event='status')
+                last_status = job["status"]
+            if time.monotonic() > deadline:
+                return
+            time.sleep(JOB_EVENTS_POLL_INTERVAL)
+            job = _visible_job(job_id)
+            if job is None:
+                return
+    return event_stream_response(events(job))
+
+@app.route('/health/jobs')
+def job_health():
+    return jsonify(job_queue.stats())
+
+@app.route('/health/uploads')
+def upload_health():
+    return jsonify(dict(uploads.upload_stats.snapshot(), job_file_bytes=job_queue.pending_file_bytes()))
+
+@app.route("/policies/upload", methods=["POST"])
+def upload_policy_document():
+    uid = session.get('user')
+    if not uid:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
+    file = request.files["file"]
+    filename = secure_filename(file.filename or "")
+    if not filename:
+        return jsonify({"error": "Empty filename"}), 400
+
+    # process_document_file picks the extractor from the extension, so keep it on the temp file.
+    suffix = os.path.splitext(filename)[1].lower()
+    with tempfile.NamedTemporaryFile(suffix=suffix, dir=uploads.UPLOAD_TMP_DIR) as tmp:
+        file.save(tmp)
+        tmp.flush()
+        with outbound_scheduler.slot("ocr", PRIORITY_BULK):
+            text = process_document_file(tmp.name)
+    if not text:
+        return jsonify({"error": "Could not extract text from the document"}), 400
+
+    # Passing the ID of one of your policies replaces it; the old version is tombstoned.
+    policy_id = request.form.get("policy_id")
+    if policy_id and policy_index.policy_owner(policy_id) != uid:
+        return jsonify({"error": "Policy not found"}), 404
+    policy_id = policy_id or uuid.uuid4().hex
+    chunk_ids = policy_index.add_policy(policy_id, uid, filename, text)
+    firestore_store.upload_policy(uid, filename, request.form.get("file_url"), chunk_ids, policy_id)
+    return jsonify({"success": True, "policy_id": policy_id, "chunks": len(chunk_ids)})
+
+@app.route("/policies/<policy_id>", methods=["DELETE"])
+def delete_policy_document(policy_id):
+    uid = session.get('user')
+    if not uid:
+        return jsonify({'error': 'Unauthorized'}), 401
+    if policy_index.policy_owner(policy_id) != uid:
+        return jsonify({"error": "Policy not found"}), 404
+    policy_index.remove_policy(policy_id)
+    firestore_store.delete_policy(policy_id)
+    return jsonify({"success": True})
+
 if __name__ == '__main__':
     server = Server(app.wsgi_app)
     server.serve()
\ No newline at end of file
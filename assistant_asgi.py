@@ -0,0 +1,162 @@
+"""ASGI sub-app serving /chat/health-assistant on an event loop.
+
+Run next to the Flask app and route /chat/health-assistant to it, e.g.
+``uvicorn assistant_asgi:app --port 8001``. It accepts the same session
+cookie and request/response contract as the Flask route.
+"""
+import asyncio
+import json
+import os
+from http.cookies import CookieError, SimpleCookie
+
+import firebase_admin
+from firebase_admin import credentials
+from flask import Flask
+from itsdangerous import BadSignature
+
+from conversation_store import conversation_store
+from health_assistant_async import (
+    close_clients,
+    llm_slots,
+    process_user_request_async,
+    process_user_request_stream_async,
+)
+from outbound_scheduler import SchedulerSaturated
+
+CHAT_PATH = "/chat/health-assistant"
+
+if not firebase_admin._apps:
+    firebase_admin.initialize_app(credentials.Certificate("firebase-key.json"))
+
+# Only used to verify the Flask session cookie with the shared secret.
+_session_app = Flask(__name__)
+_session_app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret")
+_session_serializer = _session_app.session_interface.get_signing_serializer(_session_app)
+
+
+def _session_user(scope):
+    cookie = SimpleCookie()
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            try:
+                cookie.load(value.decode("latin-1"))
+            except CookieError:
+                # A malformed header carries no usable session; treat the request as signed out.
+                return None
+    morsel = cookie.get(_session_app.config["SESSION_COOKIE_NAME"])
+    if morsel is None:
+        return None
+    try:
+        max_age = int(_session_app.permanent_session_lifetime.total_seconds())
+        return _session_serializer.loads(morsel.value, max_age=max_age).get("user")
+    except BadSignature:
+        return None
+
+
+def _header(scope, name):
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+
+def sse_event(payload, event=None):
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(payload)}")
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _chat(scope, receive, send):
+    uid = _session_user(scope)
+    if not uid:
+        return await _send_json(send, 401, {"error": "Unauthorized"})
+    try:
+        data = json.loads(await _read_body(receive) or b"{}")
+    except ValueError:
+        return await _send_json(send, 400, {"error": "Invalid JSON"})
+    user_message = data.get("message")
+    doc_summary = data.get("doc_summary")
+    if not user_message:
+        return await _send_json(send, 400, {"error": "Message is required"})
+
+    # Loading a conversation that is not in memory reads Firestore, and appending a turn
+    # can block on the write-behind queue, so both stay off the loop.
+    conversation = await asyncio.to_thread(conversation_store.open, data.get("chat_id"), uid)
+    if conversation is None:
+        return await _send_json(send, 404, {"error": "Chat not found"})
+    history = conversation.history()
+
+    stream = bool(data.get("stream")) or "text/event-stream" in _header(scope, b"accept")
+    try:
+        async with llm_slots:
+            if not stream:
+                reply = await process_user_request_async(
+                    user_message, history, doc_summary, conversation.summary, uid
+                )
+                await asyncio.to_thread(conversation_store.append_turn, conversation, user_message, reply)
+                return await _send_json(send, 200, {
+                    "response": reply,
+                    "chat_id": conversation.chat_id
+                })
+
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            parts = []
+            async for text in process_user_request_stream_async(
+                user_message, history, doc_summary, conversation.summary, uid
+            ):
+                parts.append(text)
+                await send({"type": "http.response.body", "body": sse_event({"delta": text}), "more_body": True})
+            reply = "".join(parts)
+            await asyncio.to_thread(conversation_store.append_turn, conversation, user_message, reply)
+            await send({"type": "http.response.body", "body": sse_event({
+                "response": reply,
+                "chat_id": conversation.chat_id
+            }, event="done")})
+    except SchedulerSaturated as e:
+        await _send_json(send, e.status, {"error": str(e)}, [(b"retry-after", str(e.retry_after).encode())])
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_clients()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] != CHAT_PATH:
+        return await _send_json(send, 404, {"error": "Not found"})
+    if scope["method"] != "POST":
+        return await _send_json(send, 405, {"error": "Method not allowed"})
+    await _chat(scope, receive, send)
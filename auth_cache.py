@@ -0,0 +1,90 @@
+import hashlib
+import os
+import re
+import threading
+import time
+
+import firebase_admin
+from firebase_admin import auth as firebase_auth
+from google.auth import jwt as google_jwt
+
+import http_client
+from cache import LRUCache
+
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+# Refresh the signing keys this long before Google's Cache-Control max-age runs out.
+CERTS_REFRESH_MARGIN = int(os.environ.get("CERTS_REFRESH_MARGIN", 300))
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class SigningKeys:
+    """Google's securetoken public certificates, refreshed ahead of expiry by a daemon thread."""
+
+    def __init__(self, url=FIREBASE_CERTS_URL):
+        self.url = url
+        self.certs = None
+        self.expires_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        response = http_client.get("google_certs", self.url)
+        response.raise_for_status()
+        match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else 3600
+        with self._lock:
+            self.certs = response.json()
+            self.expires_at = time.time() + max_age
+
+    def get(self):
+        if self.certs is None or self.expires_at <= time.time():
+            self.refresh()
+        return self.certs
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print("[Auth] Signing key refresh failed:", e)
+            time.sleep(max(60, self.expires_at - time.time() - CERTS_REFRESH_MARGIN))
+
+    def start_background_refresh(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="signing-key-refresh", daemon=True)
+            self._thread.start()
+
+
+signing_keys = SigningKeys()
+_verified_tokens = LRUCache(max_entries=TOKEN_CACHE_SIZE)
+
+
+def _verify_with_cached_keys(id_token):
+    # Same checks firebase_auth.verify_id_token makes (without revocation), minus the key fetch.
+    project_id = firebase_admin.get_app().project_id
+    claims = google_jwt.decode(id_token, certs=signing_keys.get(), audience=project_id)
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise ValueError("ID token has an incorrect issuer")
+    subject = claims.get("sub")
+    if not subject or len(subject) > 128:
+        raise ValueError("ID token has an invalid subject")
+    claims["uid"] = subject
+    return claims
+
+
+def verify_id_token(id_token):
+    key = hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+    decoded = _verified_tokens.get(key)
+    if decoded is not None:
+        return decoded
+    try:
+        decoded = _verify_with_cached_keys(id_token)
+    except Exception as e:
+        print("[Auth] Local verification failed, falling back to Firebase:", e)
+        decoded = firebase_auth.verify_id_token(id_token)
+    ttl = decoded["exp"] - time.time()
+    if ttl > 0:
+        _verified_tokens.set(key, decoded, ttl=ttl)
+    return decoded
@@ -0,0 +1,102 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import http_client
+
+load_dotenv()
+
+# Load Azure Health Text Analytics configuration from environment
+AZURE_HEALTH_ENDPOINT = os.environ.get("AZURE_HEALTH_ENDPOINT")
+AZURE_HEALTH_KEY = os.environ.get("AZURE_HEALTH_KEY")
+
+# Service limits for Text Analytics for health: characters per document and documents per request.
+AZURE_HEALTH_MAX_DOCUMENT_CHARS = int(os.environ.get("AZURE_HEALTH_MAX_DOCUMENT_CHARS", 5120))
+AZURE_HEALTH_BATCH_SIZE = int(os.environ.get("AZURE_HEALTH_BATCH_SIZE", 10))
+AZURE_HEALTH_CONCURRENCY = int(os.environ.get("AZURE_HEALTH_CONCURRENCY", 4))
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+_pool = ThreadPoolExecutor(max_workers=AZURE_HEALTH_CONCURRENCY, thread_name_prefix="azure-health")
+
+
+def _sentence_spans(text):
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        yield start, match.end()
+        start = match.end()
+    if start < len(text):
+        yield start, len(text)
+
+
+def chunk_text(text, max_chars=AZURE_HEALTH_MAX_DOCUMENT_CHARS):
+    """Splits text into (offset, chunk) pieces of at most max_chars, cutting between sentences.
+
+    A sentence longer than max_chars is cut at the last whitespace that fits.
+    Chunks are plain slices of the text, so offsets map straight back.
+    """
+    chunks = []
+    chunk_start = chunk_end = 0
+    for start, end in _sentence_spans(text):
+        if end - chunk_start <= max_chars:
+            chunk_end = end
+            continue
+        if chunk_end > chunk_start:
+            chunks.append((chunk_start, text[chunk_start:chunk_end]))
+            chunk_start = chunk_end
+        while end - chunk_start > max_chars:
+            cut = text.rfind(" ", chunk_start + 1, chunk_start + max_chars + 1)
+            cut = cut if cut > chunk_start else chunk_start + max_chars
+            chunks.append((chunk_start, text[chunk_start:cut]))
+            chunk_start = cut
+        chunk_end = end
+    if chunk_end > chunk_start:
+        chunks.append((chunk_start, text[chunk_start:chunk_end]))
+    return [(offset, chunk) for offset, chunk in chunks if chunk.strip()]
+
+
+def _analyze_batch(batch):
+    url = f"{AZURE_HEALTH_ENDPOINT}/text/analytics/v3.1/entities/health"
+    headers = {
+        "Ocp-Apim-Subscription-Key": AZURE_HEALTH_KEY,
+        "Content-Type": "application/json"
+    }
+    data = {
+        "documents": [
+            {"id": str(offset), "language": "en", "text": chunk} for offset, chunk in batch
+        ]
+    }
+    # Code point offsets line up with Python string indexes.
+    params = {"stringIndexType": "UnicodeCodePoint"}
+    resp = http_client.post("azure_health", url, headers=headers, params=params, json=data, idempotent=True)
+    if resp.status_code != 200:
+        raise RuntimeError(f"Azure error {resp.status_code}: {resp.text}")
+    result = resp.json()
+    if result.get("errors"):
+        error = result["errors"][0]
+        raise RuntimeError(f"Azure error for chunk at {error.get('id')}: {error.get('error')}")
+    return result["documents"]
+
+
+def analyze_health_entities(text):
+    """Entities for the whole text, with offsets into it; each (category, text) pair is kept once."""
+    chunks = chunk_text(text)
+    batches = [chunks[i:i + AZURE_HEALTH_BATCH_SIZE] for i in range(0, len(chunks), AZURE_HEALTH_BATCH_SIZE)]
+    if len(batches) == 1:
+        documents = _analyze_batch(batches[0])
+    else:
+        documents = [document for result in _pool.map(_analyze_batch, batches) for document in result]
+
+    entities = []
+    seen = set()
+    for document in sorted(documents, key=lambda d: int(d["id"])):
+        chunk_offset = int(document["id"])
+        for entity in document.get("entities", []):
+            key = (entity["category"], entity["text"].lower())
+            if key in seen:
+                continue
+            seen.add(key)
+            entities.append(dict(entity, offset=entity["offset"] + chunk_offset))
+    return entities
@@ -0,0 +1,207 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_DIR = os.environ.get(
+    "CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+)
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU with an optional per-entry TTL (seconds)."""
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    """Persistent JSON cache in a SQLite file, evicted by TTL, entry count and total size.
+
+    Several caches can share one file; entries are separated by ``namespace``.
+    """
+
+    def __init__(self, path, namespace, ttl=None, max_entries=None, max_bytes=None):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_accessed "
+                "ON cache_entries (namespace, accessed_at)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                conn.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                )
+                return default
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+        return json.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        payload = json.dumps(value)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries "
+                "(namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, payload, len(payload), now + ttl if ttl else None, now),
+            )
+            self._evict(conn, now)
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            )
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, now),
+        )
+        if self.max_entries:
+            conn.execute(
+                """DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache_entries WHERE namespace = ?
+                    ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+        if self.max_bytes:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,),
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at",
+                    (self.namespace,),
+                )
+                stale = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((self.namespace, key))
+                    total -= size
+                conn.executemany(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?", stale
+                )
+
+
+class TieredCache:
+    """In-memory LRU in front of a persistent SQLite tier."""
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        try:
+            value = self.disk.get(key, _MISSING)
+        except sqlite3.Error as e:
+            print(f"[Cache] Disk read failed for {self.disk.namespace}: {e}")
+            return default
+        if value is _MISSING:
+            return default
+        self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        try:
+            self.disk.set(key, value)
+        except sqlite3.Error as e:
+            print(f"[Cache] Disk write failed for {self.disk.namespace}: {e}")
+
+    def delete(self, key):
+        self.memory.delete(key)
+        try:
+            self.disk.delete(key)
+        except sqlite3.Error as e:
+            print(f"[Cache] Disk delete failed for {self.disk.namespace}: {e}")
+
+
+def tiered_cache(namespace, ttl=None, memory_entries=256, max_entries=None, max_bytes=None, path=None):
+    path = path or os.path.join(CACHE_DIR, "cache.sqlite3")
+    return TieredCache(
+        LRUCache(max_entries=memory_entries, ttl=ttl),
+        SQLiteCache(path, namespace, ttl=ttl, max_entries=max_entries, max_bytes=max_bytes),
+    )
@@ -0,0 +1,70 @@
+import os
+
+# Prompt budget for chat_with_bot, in (estimated) tokens.
+CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", 3000))
+# Share of the budget the document summary may take before it is truncated.
+DOC_SUMMARY_TOKENS = int(os.environ.get("DOC_SUMMARY_TOKENS", CHAT_CONTEXT_TOKENS // 3))
+# Share of the budget for policy excerpts retrieved from the policy index.
+POLICY_CONTEXT_TOKENS = int(os.environ.get("POLICY_CONTEXT_TOKENS", CHAT_CONTEXT_TOKENS // 3))
+# Once unsummarized history exceeds this, the oldest turns are folded into the rolling summary.
+CHAT_HISTORY_TOKENS = int(os.environ.get("CHAT_HISTORY_TOKENS", CHAT_CONTEXT_TOKENS // 2))
+CHAT_MIN_RECENT_MESSAGES = int(os.environ.get("CHAT_MIN_RECENT_MESSAGES", 4))
+# The new user message is cut to what the system messages leave, but never below this.
+CHAT_MIN_USER_TOKENS = int(os.environ.get("CHAT_MIN_USER_TOKENS", 100))
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    # Roughly 4 characters per token for English with the GPT tokenizers; close enough for budgeting.
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message):
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content"))
+
+
+TRUNCATION_MARKER = " [...]"
+
+
+def truncate_to_tokens(text, max_tokens):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    # Room is kept for the marker, so the result still fits max_tokens.
+    return text[:max(max_chars - len(TRUNCATION_MARKER), 0)].rsplit(" ", 1)[0] + TRUNCATION_MARKER
+
+
+def pack_messages(system_messages, history, user_message, budget=CHAT_CONTEXT_TOKENS):
+    """System messages and the new user message always go in; history fills what is left, newest first.
+
+    A user message too long for the space the system messages leave is truncated to fit.
+    """
+    remaining = budget - sum(message_tokens(m) for m in system_messages)
+    if message_tokens(user_message) > remaining:
+        max_tokens = max(remaining - MESSAGE_OVERHEAD_TOKENS, CHAT_MIN_USER_TOKENS)
+        user_message = dict(user_message, content=truncate_to_tokens(user_message.get("content") or "", max_tokens))
+    remaining -= message_tokens(user_message)
+    recent = []
+    for message in reversed(history):
+        cost = message_tokens(message)
+        if cost > remaining:
+            break
+        recent.append(message)
+        remaining -= cost
+    recent.reverse()
+    return system_messages + recent + [user_message]
+
+
+def split_for_summary(history, max_tokens=CHAT_HISTORY_TOKENS, keep=CHAT_MIN_RECENT_MESSAGES):
+    """Splits history into (older messages to fold into the summary, recent messages to keep verbatim)."""
+    total = sum(message_tokens(m) for m in history)
+    cut = 0
+    while total > max_tokens and len(history) - cut > keep:
+        total -= message_tokens(history[cut])
+        cut += 1
+    # Fold whole turns so a user message is never separated from its reply.
+    if cut % 2 and cut < len(history) - keep:
+        cut += 1
+    return history[:cut], history[cut:]
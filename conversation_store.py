@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import firestore as firestore_store
+from cache import LRUCache
+from context_window import split_for_summary
+from health_assistant import summarize_conversation
+
+# Messages kept in memory per chat; chat_with_bot only ever looks at the recent ones.
+CONVERSATION_WINDOW = int(os.environ.get("CONVERSATION_WINDOW", 50))
+CONVERSATION_CACHE_SIZE = int(os.environ.get("CONVERSATION_CACHE_SIZE", 2000))
+CONVERSATION_SUMMARY_WORKERS = int(os.environ.get("CONVERSATION_SUMMARY_WORKERS", 2))
+
+
+class Conversation:
+    def __init__(self, chat_id, owner_uid, messages=(), summary=None, last_timestamp=None):
+        self.chat_id = chat_id
+        self.owner_uid = owner_uid
+        # Messages carry the timestamp they were stored with, so a summary can record what it covers.
+        self.window = deque(messages, maxlen=CONVERSATION_WINDOW)
+        # Newest message this copy knows of, summarized or not; newer ones in Firestore mean it is stale.
+        self.last_timestamp = last_timestamp or (self.window[-1]["timestamp"] if self.window else None)
+        self.summary = summary
+        # Turns being folded into the summary; still sent verbatim until the new summary lands.
+        self.folding = []
+        self.lock = threading.Lock()
+
+    def history(self):
+        with self.lock:
+            return [{"role": m["role"], "content": m["content"]} for m in self.folding + list(self.window)]
+
+
+class ConversationStore:
+    """Append-only chat history persisted to chats/{id}/messages with a bounded in-memory window.
+
+    Each turn checks the newest stored message against the cached copy, since
+    the Flask app, the ASGI app and every gunicorn worker hold their own; a
+    copy that missed a turn written elsewhere is reloaded from Firestore, as
+    is one evicted from memory.
+    """
+
+    def __init__(self):
+        self._conversations = LRUCache(max_entries=CONVERSATION_CACHE_SIZE)
+        self._load_lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(
+            max_workers=CONVERSATION_SUMMARY_WORKERS, thread_name_prefix="chat-summary"
+        )
+
+    def create(self, owner_uid, context_ids=None):
+        chat_id = firestore_store.start_chat(owner_uid, context_ids or [])
+        conversation = Conversation(chat_id, owner_uid)
+        self._conversations.set(chat_id, conversation)
+        return conversation
+
+    def get(self, chat_id, owner_uid):
+        conversation = self._conversations.get(chat_id)
+        if conversation is not None and conversation.owner_uid != owner_uid:
+            return None
+        if conversation is not None and self._is_stale(conversation):
+            self._conversations.delete(chat_id)
+            conversation = None
+        if conversation is None:
+            with self._load_lock:
+                conversation = self._conversations.get(chat_id) or self._load(chat_id)
+                if conversation is None:
+                    return None
+                self._conversations.set(chat_id, conversation)
+        if conversation.owner_uid != owner_uid:
+            return None
+        return conversation
+
+    def _is_stale(self, conversation):
+        # One indexed read; our own uncommitted messages are newer than anything stored, so they never trigger it.
+        latest = firestore_store.latest_message_time(conversation.chat_id)
+        with conversation.lock:
+            known = conversation.last_timestamp
+        return latest is not None and (known is None or latest > known)
+
+    def open(self, chat_id, owner_uid):
+        if not chat_id:
+            return self.create(owner_uid)
+        return self.get(chat_id, owner_uid)
+
+    def append(self, conversation, role, content):
+        timestamp = datetime.now(timezone.utc)
+        with conversation.lock:
+            conversation.window.append({"role": role, "content": content, "timestamp": timestamp})
+            conversation.last_timestamp = timestamp
+        firestore_store.send_message(conversation.chat_id, role, content, timestamp=timestamp)
+
+    def append_turn(self, conversation, user_message, reply):
+        self.append(conversation, "user", user_message)
+        self.append(conversation, "assistant", reply)
+        self._compact(conversation)
+
+    def _compact(self, conversation):
+        # Once recent history outgrows its token share, fold the oldest turns into the
+        # rolling summary in the background so the reply is never delayed by it.
+        with conversation.lock:
+            if conversation.folding:
+                return
+            older, recent = split_for_summary(list(conversation.window))
+            if not older:
+                return
+            conversation.folding = older
+            conversation.window = deque(recent, maxlen=CONVERSATION_WINDOW)
+        self._summarizer.submit(self._fold, conversation)
+
+    def _fold(self, conversation):
+        try:
+            summary = summarize_conversation(conversation.summary, conversation.folding)
+        except Exception as e:
+            print(f"[Chat] Summarizing chat {conversation.chat_id} failed: {e}")
+            with conversation.lock:
+                conversation.window = deque(
+                    conversation.folding + list(conversation.window), maxlen=CONVERSATION_WINDOW
+                )
+                conversation.folding = []
+            return
+        with conversation.lock:
+            summarized_through = conversation.folding[-1]["timestamp"]
+            conversation.summary = summary
+            conversation.folding = []
+        firestore_store.update_chat_summary(conversation.chat_id, summary, summarized_through)
+
+    def _load(self, chat_id):
+        chat_doc = firestore_store.get_db().collection("chats").document(chat_id).get()
+        if not chat_doc.exists:
+            return None
+        chat = chat_doc.to_dict()
+        recent, _ = firestore_store.get_messages(chat_id, limit=CONVERSATION_WINDOW)
+        messages = [
+            {"role": m["sender"], "content": m["text"], "timestamp": datetime.fromisoformat(m["timestamp"])}
+            for m in reversed(recent)
+        ]
+        last_timestamp = messages[-1]["timestamp"] if messages else None
+        # Turns already folded into the summary are not read back, or they would be sent twice.
+        summarized_through = chat.get("summarizedThrough")
+        if summarized_through:
+            messages = [m for m in messages if m["timestamp"] > summarized_through]
+        return Conversation(chat_id, chat.get("ownerUid"), messages, chat.get("summary"), last_timestamp)
+
+
+conversation_store = ConversationStore()
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+from cache import tiered_cache
+
+# Processing results for uploaded documents, keyed by the SHA-256 of the file bytes:
+# extracted text, health entities and summaries. A repeat upload of the same file
+# skips OCR and the upstream calls. The on-disk tier is evicted by total size.
+DOCUMENT_CACHE_TTL = int(os.environ.get("DOCUMENT_CACHE_TTL", 30 * 24 * 3600))
+DOCUMENT_CACHE_MAX_BYTES = int(os.environ.get("DOCUMENT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+document_cache = tiered_cache(
+    "documents",
+    ttl=DOCUMENT_CACHE_TTL,
+    memory_entries=int(os.environ.get("DOCUMENT_CACHE_MEMORY_ENTRIES", 64)),
+    max_bytes=DOCUMENT_CACHE_MAX_BYTES,
+)
+
+
+def bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path_or_file):
+    digest = hashlib.sha256()
+    if isinstance(path_or_file, (str, os.PathLike)):
+        with open(path_or_file, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    else:
+        position = path_or_file.tell()
+        for block in iter(lambda: path_or_file.read(1024 * 1024), b""):
+            digest.update(block)
+        path_or_file.seek(position)
+    return digest.hexdigest()
+
+
+def get(digest):
+    # Copy so callers never mutate the entry held by the memory tier.
+    return dict(document_cache.get(digest) or {})
+
+
+def update(digest, **fields):
+    entry = get(digest)
+    entry.update(fields)
+    document_cache.set(digest, entry)
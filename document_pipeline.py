@@ -0,0 +1,76 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import document_cache
+from azure_health import AZURE_HEALTH_ENDPOINT, AZURE_HEALTH_KEY, analyze_health_entities
+from health_assistant import (
+    SUPPORTED_IMAGE_EXTENSIONS,
+    SUPPORTED_PDF_EXTENSIONS,
+    SUPPORTED_TEXT_EXTENSIONS,
+    process_document_file,
+)
+from medical_entities import extract_entities, merge_entities, summarize_entities
+
+UPLOAD_EXTENSIONS = tuple(SUPPORTED_TEXT_EXTENSIONS + SUPPORTED_PDF_EXTENSIONS + SUPPORTED_IMAGE_EXTENSIONS)
+UPLOAD_MAX_FILES = int(os.environ.get("UPLOAD_MAX_FILES", 20))
+# Files of one upload are extracted side by side; PDFs and OCR fan out further in their own pools.
+# Each worker process runs one job at a time, so the number of workers bounds OCR and
+# Azure Health load, and the job queue keeps identical uploads from running side by side.
+UPLOAD_EXTRACT_WORKERS = int(os.environ.get("UPLOAD_EXTRACT_WORKERS", 4))
+# Entities are extracted in-process; Azure Health Text Analytics only adds to them when enabled.
+AZURE_HEALTH_ENRICHMENT = os.environ.get("AZURE_HEALTH_ENRICHMENT", "").lower() in ("1", "true", "yes")
+
+
+def is_supported_upload(filename):
+    return filename.lower().endswith(UPLOAD_EXTENSIONS)
+
+
+def bundle_digest(digests):
+    # A single file keeps its own digest, so its cached results are shared with other paths.
+    if len(digests) == 1:
+        return digests[0]
+    return document_cache.bytes_digest("+".join(digests).encode("utf-8"))
+
+
+def _extract_file_text(upload):
+    # process_document_file picks the extractor from the extension and caches the text by content.
+    return process_document_file(upload["path"]) or ""
+
+
+def process_upload(files, digest):
+    """Extracts every file concurrently, merges the texts in upload order and summarizes the entities."""
+    cached = document_cache.get(digest)
+    if "doc_summary" in cached:
+        return {"doc_summary": cached["doc_summary"]}
+
+    text = cached.get("text") or ""
+    if not text.strip():
+        if len(files) == 1:
+            text = _extract_file_text(files[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(UPLOAD_EXTRACT_WORKERS, len(files))) as pool:
+                texts = list(pool.map(_extract_file_text, files))
+            text = "\n\n".join(
+                f"--- {upload['filename']} ---\n{file_text}" for upload, file_text in zip(files, texts) if file_text
+            )
+        if not text.strip():
+            # Nothing is cached, so the next upload of the same files is extracted again.
+            return {"doc_summary": "No text could be extracted from the uploaded documents."}
+        document_cache.update(digest, text=text)
+
+    entities = extract_entities(text)
+    if AZURE_HEALTH_ENRICHMENT and AZURE_HEALTH_ENDPOINT and AZURE_HEALTH_KEY:
+        try:
+            entities = merge_entities(entities, analyze_health_entities(text))
+        except Exception as e:
+            print(f"[Upload] Azure Health enrichment failed, using local entities only: {e}")
+    summary = summarize_entities(entities)
+    document_cache.update(digest, entities=entities, doc_summary=summary)
+    return {"doc_summary": summary}
+
+
+def run_upload_job(payload):
+    # Jobs queued before multi-file uploads carry a single file at the top level.
+    # The job queue removes the files once the job is done or has failed for good.
+    files = payload.get("files") or [payload]
+    return process_upload(files, payload["digest"])
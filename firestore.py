@@ -1,10 +1,55 @@
+import atexit
+import base64
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
 from firebase_admin import firestore, _apps
 
+from cache import LRUCache
+from firestore_writer import WriteBehindWriter
+
+# User documents are read through a TTL cache. With USER_CACHE_LISTEN enabled a
+# snapshot listener per cached user keeps entries fresh between TTL expiries.
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 300))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 5000))
+USER_CACHE_LISTEN = os.environ.get("USER_CACHE_LISTEN", "").lower() in ("1", "true", "yes")
+USER_CACHE_MAX_LISTENERS = int(os.environ.get("USER_CACHE_MAX_LISTENERS", 500))
+
+_user_cache = LRUCache(max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+_user_listeners = {}
+_user_listeners_lock = threading.Lock()
+
+# Chat history is read in cursor pages. Pages older than the newest are immutable
+# (messages are append-only) and cached until evicted. The newest pages of each chat
+# (one per page size) are cached briefly and dropped whenever this process sends a
+# message to the chat, both when it is queued and when it commits.
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 30))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", 100))
+HISTORY_PAGE_CACHE_SIZE = int(os.environ.get("HISTORY_PAGE_CACHE_SIZE", 2000))
+HISTORY_LATEST_PAGE_TTL = int(os.environ.get("HISTORY_LATEST_PAGE_TTL", 10))
+# A new chat is committed before its id is handed out; covers the writer's retries.
+CHAT_CREATE_TIMEOUT = float(os.environ.get("CHAT_CREATE_TIMEOUT", 30))
+
+_history_pages = LRUCache(max_entries=HISTORY_PAGE_CACHE_SIZE)
+_latest_pages = LRUCache(max_entries=HISTORY_PAGE_CACHE_SIZE, ttl=HISTORY_LATEST_PAGE_TTL)
+# Bumped on every invalidation, so a read that overlapped a write doesn't cache its stale page.
+_latest_versions = LRUCache(max_entries=HISTORY_PAGE_CACHE_SIZE)
+_pending_messages = {}
+_latest_lock = threading.Lock()
+_chat_owners = LRUCache(max_entries=HISTORY_PAGE_CACHE_SIZE)
+
 def get_db():
     if not _apps:
         raise RuntimeError("Firebase not initialized! Initialize in app.py first.")
     return firestore.client()
 
+# Chat messages, claims, PA requests and policies are written behind the request
+# in batched commits; each writer function returns a Future for its write.
+writer = WriteBehindWriter(get_db)
+atexit.register(writer.close)
+
 def create_user(uid, email, display_name, role="client"):
     db= get_db()
     user_data = {
@@ -14,9 +59,39 @@ def create_user(uid, email, display_name, role="client"):
         "createdAt": firestore.SERVER_TIMESTAMP
     }
     db.collection("users").document(uid).set(user_data)
+    invalidate_user(uid)
+
+
+def get_user(uid):
+    user = _user_cache.get(uid)
+    if user is not None:
+        return user
+    db = get_db()
+    user_doc = db.collection("users").document(uid).get()
+    user = user_doc.to_dict() if user_doc.exists else {}
+    _user_cache.set(uid, user)
+    if USER_CACHE_LISTEN:
+        _listen_to_user(uid)
+    return user
 
 
-def upload_policy(owner_uid, name, file_url, chunk_ids):
+def invalidate_user(uid):
+    _user_cache.delete(uid)
+
+
+def _listen_to_user(uid):
+    with _user_listeners_lock:
+        if uid in _user_listeners or len(_user_listeners) >= USER_CACHE_MAX_LISTENERS:
+            return
+
+        def on_snapshot(doc_snapshots, changes, read_time):
+            for doc in doc_snapshots:
+                _user_cache.set(uid, doc.to_dict() if doc.exists else {})
+
+        _user_listeners[uid] = get_db().collection("users").document(uid).on_snapshot(on_snapshot)
+
+
+def upload_policy(owner_uid, name, file_url, chunk_ids, policy_id=None):
     db = get_db()
     policy = {
         "ownerUid": owner_uid,
@@ -25,7 +100,14 @@ def upload_policy(owner_uid, name, file_url, chunk_ids):
         "chunkIds": chunk_ids,
         "uploadedAt": firestore.SERVER_TIMESTAMP
     }
-    db.collection("policies").add(policy) 
+    policies = db.collection("policies")
+    doc_ref = policies.document(policy_id) if policy_id else policies.document()
+    return writer.set(doc_ref, policy)
+
+def delete_policy(policy_id):
+    # Let a queued upload of the same policy land first so the delete is not overtaken by it.
+    writer.flush()
+    return get_db().collection("policies").document(policy_id).delete()
 
 def create_pa_request(pa_id, client_uid, provider_id, diagnoses, services, ref):
     db = get_db()
@@ -38,8 +120,7 @@ def create_pa_request(pa_id, client_uid, provider_id, diagnoses, services, ref):
         "status": "pending",
         "createdAt": firestore.SERVER_TIMESTAMP
     }
-    db.collection("paRequests").document(pa_id).set(pa_data)
-    
+    return writer.set(db.collection("paRequests").document(pa_id), pa_data)
 
 
 def create_claim(claim_id, client_uid, provider_id, ref, billed_amount, items):
@@ -53,29 +134,150 @@ def create_claim(claim_id, client_uid, provider_id, ref, billed_amount, items):
         "status": "pending",
         "createdAt": firestore.SERVER_TIMESTAMP
     }
-    db.collection("claims").document(claim_id).set(claim_data)
+    return writer.set(db.collection("claims").document(claim_id), claim_data)
 
 
 def start_chat(owner_uid, context_ids):
     db = get_db()
     chat_ref = db.collection("chats").document()
-    chat_ref.set({
+    # Waited for, so the chat can be read (and its owner checked) as soon as its id is returned.
+    writer.set(chat_ref, {
         "ownerUid": owner_uid,
         "contextIds": context_ids,
         "createdAt": firestore.SERVER_TIMESTAMP
-    })
+    }).result(timeout=CHAT_CREATE_TIMEOUT)
     return chat_ref.id
 
 
-def send_message(chat_id, sender, text, sources=None):
+def update_chat_summary(chat_id, summary, summarized_through):
+    # summarizedThrough is the timestamp of the last message folded into the summary.
+    db = get_db()
+    return writer.set(db.collection("chats").document(chat_id), {
+        "summary": summary,
+        "summarizedThrough": summarized_through,
+        "summaryUpdatedAt": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+
+def send_message(chat_id, sender, text, sources=None, timestamp=None):
     db = get_db()
+    # Stamped when sent rather than with SERVER_TIMESTAMP: writes in one batch share a
+    # commit time, which would make a user message and its reply tie in history order.
     message_data = {
         "sender": sender,
         "text": text,
-        "timestamp": firestore.SERVER_TIMESTAMP
+        "timestamp": timestamp or datetime.now(timezone.utc)
     }
     if sources:
         message_data["sources"] = sources
 
-    db.collection("chats").document(chat_id).collection("messages").add(message_data)
+    message_ref = db.collection("chats").document(chat_id).collection("messages").document()
+    _invalidate_latest_pages(chat_id, pending=1)
+    try:
+        future = writer.set(message_ref, message_data)
+    except Exception:
+        _invalidate_latest_pages(chat_id, pending=-1)
+        raise
+    future.add_done_callback(lambda _: _invalidate_latest_pages(chat_id, pending=-1))
+    return future
+
+
+def _invalidate_latest_pages(chat_id, pending):
+    with _latest_lock:
+        count = _pending_messages.get(chat_id, 0) + pending
+        if count:
+            _pending_messages[chat_id] = count
+        else:
+            _pending_messages.pop(chat_id, None)
+        _latest_versions.set(chat_id, (_latest_versions.get(chat_id) or 0) + 1)
+        _latest_pages.delete(chat_id)
+
+
+def encode_cursor(message):
+    raw = json.dumps({"t": message["timestamp"], "id": message["id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return {"timestamp": datetime.fromisoformat(raw["t"]), "__name__": raw["id"]}
+
+
+def _message_from_doc(doc):
+    data = doc.to_dict()
+    message = {
+        "id": doc.id,
+        "sender": data.get("sender"),
+        "text": data.get("text"),
+        "timestamp": data["timestamp"].isoformat() if data.get("timestamp") else None
+    }
+    if data.get("sources"):
+        message["sources"] = data["sources"]
+    return message
+
+
+def _messages_query(chat_id, direction):
+    return (
+        get_db().collection("chats").document(chat_id).collection("messages")
+        .order_by("timestamp", direction=direction)
+        .order_by("__name__", direction=direction)
+    )
+
+
+def latest_message_time(chat_id):
+    """Timestamp of the newest committed message in the chat, or None; always read from Firestore."""
+    docs = list(_messages_query(chat_id, firestore.Query.DESCENDING).limit(1).stream())
+    return docs[0].to_dict().get("timestamp") if docs else None
+
+
+def get_chat_owner(chat_id):
+    owner = _chat_owners.get(chat_id)
+    if owner is None:
+        chat_doc = get_db().collection("chats").document(chat_id).get()
+        if not chat_doc.exists:
+            return None
+        owner = chat_doc.to_dict().get("ownerUid")
+        _chat_owners.set(chat_id, owner)
+    return owner
+
+
+def get_messages(chat_id, limit=HISTORY_PAGE_SIZE, before=None):
+    """Returns (messages newest first, cursor for the next older page or None)."""
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    if before:
+        page = _history_pages.get((chat_id, before, limit))
+    else:
+        with _latest_lock:
+            page = (_latest_pages.get(chat_id) or {}).get(limit)
+            # Not cached while one of our own messages to the chat is still uncommitted.
+            version = None if chat_id in _pending_messages else (_latest_versions.get(chat_id) or 0)
+    if page is not None:
+        return page
+    query = _messages_query(chat_id, firestore.Query.DESCENDING)
+    if before:
+        query = query.start_after(decode_cursor(before))
+    # One extra document tells us whether an older page exists.
+    docs = list(query.limit(limit + 1).stream())
+    messages = [_message_from_doc(doc) for doc in docs[:limit]]
+    next_cursor = encode_cursor(messages[-1]) if len(docs) > limit else None
+    page = (messages, next_cursor)
+    if before:
+        _history_pages.set((chat_id, before, limit), page)
+    else:
+        with _latest_lock:
+            if version is not None and version == (_latest_versions.get(chat_id) or 0):
+                latest = dict(_latest_pages.get(chat_id) or {})
+                latest[limit] = page
+                _latest_pages.set(chat_id, latest)
+    return page
+
+
+def get_messages_since(chat_id, after, limit=HISTORY_MAX_PAGE_SIZE):
+    """Delta fetch: messages newer than the ``after`` cursor, oldest first, plus the cursor to poll with next."""
+    query = _messages_query(chat_id, firestore.Query.ASCENDING)
+    if after:
+        query = query.start_after(decode_cursor(after))
+    messages = [_message_from_doc(doc) for doc in query.limit(limit).stream()]
+    latest_cursor = encode_cursor(messages[-1]) if messages else after
+    return messages, latest_cursor
 
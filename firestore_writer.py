@@ -0,0 +1,161 @@
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from google.api_core import exceptions as google_exceptions
+
+FIRESTORE_BATCH_LIMIT = 500
+WRITE_BEHIND_BATCH_SIZE = min(int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500)), FIRESTORE_BATCH_LIMIT)
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL", 0.2))
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000))
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.environ.get("WRITE_BEHIND_ENQUEUE_TIMEOUT", 5))
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 5))
+WRITE_BEHIND_BACKOFF_BASE = float(os.environ.get("WRITE_BEHIND_BACKOFF_BASE", 0.2))
+WRITE_BEHIND_BACKOFF_MAX = float(os.environ.get("WRITE_BEHIND_BACKOFF_MAX", 5))
+
+# Errors worth retrying the same commit for; anything else is blamed on a write in the batch.
+TRANSIENT_ERRORS = (
+    google_exceptions.Aborted,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+class _Write:
+    def __init__(self, doc_ref, data, merge):
+        self.doc_ref = doc_ref
+        self.data = data
+        self.merge = merge
+        self.future = Future()
+
+
+class _Flush:
+    def __init__(self):
+        self.future = Future()
+
+
+class WriteBehindWriter:
+    """Queues document writes and commits them in Firestore WriteBatches.
+
+    A batch is committed when it reaches ``batch_size`` writes or when
+    ``flush_interval`` seconds have passed since its first write. Every
+    write returns a Future resolved once its batch commits. Transient
+    commit errors are retried with backoff; on any other error the batch is
+    split until only the offending writes fail. The queue is bounded:
+    producers block for up to WRITE_BEHIND_ENQUEUE_TIMEOUT seconds and then
+    get ``queue.Full``.
+    """
+
+    def __init__(self, get_client, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_queue=WRITE_BEHIND_QUEUE_SIZE):
+        self.get_client = get_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.committed_batches = 0
+        self.committed_writes = 0
+        self.failed_writes = 0
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="firestore-write-behind", daemon=True)
+                self._thread.start()
+
+    def set(self, doc_ref, data, merge=False):
+        if self._closed:
+            raise RuntimeError("Firestore writer is closed")
+        self._ensure_started()
+        write = _Write(doc_ref, data, merge)
+        self._queue.put(write, timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT)
+        return write.future
+
+    def flush(self, timeout=None):
+        if self._thread is None:
+            return
+        marker = _Flush()
+        self._queue.put(marker)
+        marker.future.result(timeout)
+
+    def close(self, timeout=30):
+        self.flush(timeout)
+        self._closed = True
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            pending = []
+            markers = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                    break
+                pending.append(item)
+                if len(pending) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if pending:
+                self._commit(pending)
+            for marker in markers:
+                marker.future.set_result(None)
+
+    def _commit_batch(self, writes):
+        attempt = 0
+        while True:
+            try:
+                batch = self.get_client().batch()
+                for write in writes:
+                    batch.set(write.doc_ref, write.data, merge=write.merge)
+                batch.commit()
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt >= WRITE_BEHIND_MAX_RETRIES:
+                    raise
+                print(f"[Firestore] Batch of {len(writes)} writes failed, retrying: {e}")
+                time.sleep(random.uniform(0, min(WRITE_BEHIND_BACKOFF_MAX, WRITE_BEHIND_BACKOFF_BASE * (2 ** attempt))))
+                attempt += 1
+
+    def _commit(self, writes):
+        try:
+            self._commit_batch(writes)
+        except Exception as e:
+            if len(writes) > 1 and not isinstance(e, TRANSIENT_ERRORS):
+                # Batches are atomic, so halve it until the bad writes are isolated.
+                middle = len(writes) // 2
+                self._commit(writes[:middle])
+                self._commit(writes[middle:])
+                return
+            print(f"[Firestore] Batch of {len(writes)} writes failed: {e}")
+            self.failed_writes += len(writes)
+            for write in writes:
+                write.future.set_exception(e)
+            return
+        self.committed_batches += 1
+        self.committed_writes += len(writes)
+        for write in writes:
+            write.future.set_result(write.doc_ref.id)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "committed_batches": self.committed_batches,
+            "committed_writes": self.committed_writes,
+            "failed_writes": self.failed_writes,
+        }
@@ -1,15 +1,26 @@
 # Create a new file health_assistant.py with the core functionality
 import os
 import requests
+import http_client
 import json
+import hashlib
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import PyPDF2
 import pytesseract
-from PIL import Image
-import PyPDF2
-import fitz  # PyMuPDF for PDF text extraction
 from pathlib import Path
 from dotenv import load_dotenv
+from singleflight import SingleFlight
+from context_window import DOC_SUMMARY_TOKENS, POLICY_CONTEXT_TOKENS, pack_messages, truncate_to_tokens
+from policy_index import policy_index
+from intent_router import CLAIM_STATUS, COST_ESTIMATE, COVERAGE_CHECK, route_message
+from pdf_extraction import extract_pdf_pages
+from ocr import ocr_image_file
+import azure_health
+import document_cache
+import outbound_scheduler
+from outbound_scheduler import PRIORITY_BULK, SchedulerSaturated
 
 # Load environment variables
 load_dotenv()
@@ -57,41 +68,12 @@ def check_environment_variables():
     print("Environment variables loaded successfully!")
     return True
 
-def extract_text_from_pdf_pypdf2(file_path):
-    try:
-        text = ""
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page in pdf_reader.pages:
-                t = page.extract_text()
-                if t:
-                    text += t + "\n"
-        return text.strip()
-    except Exception as e:
-        print(f"Error extracting text from PDF with PyPDF2: {str(e)}")
-        return None
-
-def extract_text_from_pdf_pymupdf(file_path):
-    try:
-        text = ""
-        pdf_document = fitz.open(file_path)
-        for page_num in range(pdf_document.page_count):
-            page = pdf_document[page_num]
-            text += page.get_text() + "\n"
-        pdf_document.close()
-        return text.strip()
-    except Exception as e:
-        print(f"Error extracting text from PDF with PyMuPDF: {str(e)}")
-        return None
-
 def extract_text_from_pdf(file_path):
     print("Extracting text from PDF...")
-    text = extract_text_from_pdf_pypdf2(file_path)
-    if not text or len(text.strip()) < 50:
-        print("Trying alternative PDF extraction method...")
-        text = extract_text_from_pdf_pymupdf(file_path)
-    if text and len(text.strip()) > 0:
-        print(f"Successfully extracted {len(text)} characters from PDF")
+    pages = extract_pdf_pages(file_path)
+    text = "\n".join(pages).strip() if pages else ""
+    if text:
+        print(f"Successfully extracted {len(text)} characters from {len(pages)} PDF pages")
         return text
     else:
         print("Failed to extract text from PDF")
@@ -109,10 +91,7 @@ def extract_text_from_image(file_path):
             print("- macOS: brew install tesseract")
             print("- Linux: sudo apt install tesseract-ocr")
             return None
-        image = Image.open(file_path)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        text = pytesseract.image_to_string(image, lang='eng')
+        text = ocr_image_file(file_path)
         if text and len(text.strip()) > 0:
             print(f"Successfully extracted {len(text)} characters from image")
             return text.strip()
@@ -128,36 +107,36 @@ def process_document_file(file_path):
         print(f"Error: File '{file_path}' not found.")
         return None
     file_extension = Path(file_path).suffix.lower()
+    if file_extension not in SUPPORTED_TEXT_EXTENSIONS + SUPPORTED_PDF_EXTENSIONS + SUPPORTED_IMAGE_EXTENSIONS:
+        print(f"Unsupported file type: {file_extension}")
+        print(f"Supported formats:")
+        print(f"  Text files: {', '.join(SUPPORTED_TEXT_EXTENSIONS)}")
+        print(f"  PDF files: {', '.join(SUPPORTED_PDF_EXTENSIONS)}")
+        print(f"  Image files: {', '.join(SUPPORTED_IMAGE_EXTENSIONS)}")
+        return None
+    # The same file uploaded again skips extraction and OCR entirely.
+    digest = document_cache.file_digest(file_path)
+    text = document_cache.get(digest).get("text")
+    if text:
+        print("Using cached text for this document")
+        return text
     try:
         if file_extension in SUPPORTED_TEXT_EXTENSIONS:
             print("Processing text file...")
             with open(file_path, "r", encoding="utf-8") as f:
-                return f.read()
+                text = f.read()
         elif file_extension in SUPPORTED_PDF_EXTENSIONS:
-            return extract_text_from_pdf(file_path)
-        elif file_extension in SUPPORTED_IMAGE_EXTENSIONS:
-            return extract_text_from_image(file_path)
+            text = extract_text_from_pdf(file_path)
         else:
-            print(f"Unsupported file type: {file_extension}")
-            print(f"Supported formats:")
-            print(f"  Text files: {', '.join(SUPPORTED_TEXT_EXTENSIONS)}")
-            print(f"  PDF files: {', '.join(SUPPORTED_PDF_EXTENSIONS)}")
-            print(f"  Image files: {', '.join(SUPPORTED_IMAGE_EXTENSIONS)}")
-            return None
+            text = extract_text_from_image(file_path)
     except Exception as e:
         print(f"Error processing file: {str(e)}")
         return None
+    if text:
+        document_cache.update(digest, text=text)
+    return text
 
-def analyze_document_with_gpt(doc_text):
-    # Very solid prompt for medical document analysis
-    prompt = f"""
-You are a highly knowledgeable, ethical, and helpful medical assistant. 
-A user has uploaded the following medical document (could be a doctor’s note, lab result, discharge summary, scan report, referral, or insurance form): 
-
---- DOCUMENT START ---
-{doc_text[:3500]}
---- DOCUMENT END ---
-
+DOCUMENT_ANALYSIS_INSTRUCTIONS = """
 1. Summarize the main findings and information in this document.
 2. List any key diagnoses, symptoms, medications, or procedures mentioned.
 3. Highlight any abnormal results or values (if present).
@@ -166,34 +145,119 @@ A user has uploaded the following medical document (could be a doctor’s note,
 
 Return your answers as concise bullet points under each numbered instruction above.
 """
+
+CHUNK_NOTES_PROMPT = """Take notes on this part of a medical document. Keep every finding, diagnosis, symptom,
+medication (with dose), procedure, date and test value, and mark values flagged as abnormal.
+Be concise (under 200 words) and do not add anything that is not in the text.
+
+--- PART START ---
+{text}
+--- PART END ---
+"""
+
+# Documents up to one chunk are analyzed in a single call. Longer ones are split,
+# each chunk is condensed into notes in parallel, and the notes are analyzed instead.
+DOC_ANALYSIS_CHUNK_CHARS = int(os.getenv("DOC_ANALYSIS_CHUNK_CHARS", 3500))
+DOC_ANALYSIS_WORKERS = int(os.getenv("DOC_ANALYSIS_WORKERS", 4))
+# Notes longer than this in total are condensed again, in groups, before the final call.
+DOC_ANALYSIS_REDUCE_CHARS = int(os.getenv("DOC_ANALYSIS_REDUCE_CHARS", 12000))
+# Analysis calls are bulk work on pool threads: they yield to chat calls and wait this long for a slot.
+DOC_ANALYSIS_SLOT_WAIT = float(os.getenv("DOC_ANALYSIS_SLOT_WAIT", 120))
+
+_analysis_pool = ThreadPoolExecutor(max_workers=DOC_ANALYSIS_WORKERS, thread_name_prefix="doc-analysis")
+
+def _document_completion(prompt, max_tokens, temperature):
+    messages = [
+        {"role": "system", "content": "You are a careful medical document summarizer and explainer."},
+        {"role": "user", "content": prompt}
+    ]
+    data = {
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": 0.85
+    }
+    deadline = time.monotonic() + DOC_ANALYSIS_SLOT_WAIT
+    while True:
+        try:
+            with outbound_scheduler.slot("azure_openai", PRIORITY_BULK, timeout=max(deadline - time.monotonic(), 0.1)):
+                result = azure_chat_completion(data)
+            return result["choices"][0]["message"]["content"]
+        except SchedulerSaturated as e:
+            # Turned away or evicted by interactive calls; back off and queue again.
+            if time.monotonic() + e.retry_after > deadline:
+                raise
+            time.sleep(e.retry_after)
+
+def _chunk_notes(text):
+    # Notes are cached per chunk, so a page shared by two uploads is only read once.
+    digest = document_cache.bytes_digest(text.encode("utf-8"))
+    notes = document_cache.get(digest).get("chunk_notes")
+    if notes:
+        return notes
+    notes = _document_completion(CHUNK_NOTES_PROMPT.format(text=text), max_tokens=300, temperature=0.2)
+    document_cache.update(digest, chunk_notes=notes)
+    return notes
+
+def _condense(parts):
+    """Groups consecutive parts up to DOC_ANALYSIS_REDUCE_CHARS and takes notes on each group."""
+    groups = [[]]
+    size = 0
+    for part in parts:
+        if groups[-1] and size + len(part) > DOC_ANALYSIS_REDUCE_CHARS:
+            groups.append([])
+            size = 0
+        groups[-1].append(part)
+        size += len(part)
+    if len(groups) == len(parts):
+        return parts
+    return list(_analysis_pool.map(_chunk_notes, ["\n\n".join(group) for group in groups]))
+
+def analyze_document_with_gpt(doc_text):
+    # Analyses are cached on the SHA-256 of the document text.
+    text_digest = document_cache.bytes_digest(doc_text.encode("utf-8"))
+    analysis = document_cache.get(text_digest).get("analysis")
+    if analysis:
+        return analysis
     try:
-        messages = [
-            {"role": "system", "content": "You are a careful medical document summarizer and explainer."},
-            {"role": "user", "content": prompt}
-        ]
-        endpoint = AZURE_OPENAI_ENDPOINT.rstrip('/')
-        url = f"{endpoint}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version=2024-12-01-preview"
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": AZURE_OPENAI_KEY
-        }
-        data = {
-            "messages": messages,
-            "max_tokens": 800,
-            "temperature": 0.5,
-            "top_p": 0.85
-        }
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        if len(doc_text) <= DOC_ANALYSIS_CHUNK_CHARS:
+            # Very solid prompt for medical document analysis
+            prompt = f"""
+You are a highly knowledgeable, ethical, and helpful medical assistant. 
+A user has uploaded the following medical document (could be a doctor’s note, lab result, discharge summary, scan report, referral, or insurance form): 
+
+--- DOCUMENT START ---
+{doc_text}
+--- DOCUMENT END ---
+{DOCUMENT_ANALYSIS_INSTRUCTIONS}"""
+        else:
+            chunks = [chunk for _, chunk in azure_health.chunk_text(doc_text, DOC_ANALYSIS_CHUNK_CHARS)]
+            notes = list(_analysis_pool.map(_chunk_notes, chunks))
+            print(f"Analyzed {len(chunks)} document chunks")
+            notes = [f"Part {n} of {len(notes)}:\n{part}" for n, part in enumerate(notes, 1)]
+            while sum(len(part) for part in notes) > DOC_ANALYSIS_REDUCE_CHARS:
+                condensed = _condense(notes)
+                if len(condensed) == len(notes):
+                    break
+                notes = condensed
+            joined_notes = "\n\n".join(notes)
+            prompt = f"""
+You are a highly knowledgeable, ethical, and helpful medical assistant. 
+A user has uploaded a long medical document (could be a doctor’s note, lab result, discharge summary, scan report, referral, or insurance form). 
+It was read in parts; these are the notes taken on each part, in document order:
+
+--- NOTES START ---
+{joined_notes}
+--- NOTES END ---
+{DOCUMENT_ANALYSIS_INSTRUCTIONS}"""
+        analysis = _document_completion(prompt, max_tokens=800, temperature=0.5)
+        document_cache.update(text_digest, analysis=analysis)
+        return analysis
     except Exception as e:
         print(f"Error during document analysis: {e}")
         return None
 
-def chat_with_bot(message, conversation=[], doc_summary=None, curacel_context=None):
-    try:
-        system_message = """You are an intelligent health assistant with access to medical document analysis and health insurance claims processing through Curacel. 
+CHAT_SYSTEM_MESSAGE = """You are an intelligent health assistant with access to medical document analysis and health insurance claims processing through Curacel. 
         
         You can help users with:
         - General health questions and advice
@@ -203,26 +267,77 @@ def chat_with_bot(message, conversation=[], doc_summary=None, curacel_context=No
         - Insurance coverage verification
         
         Always provide helpful, accurate medical information while reminding users to consult healthcare professionals for serious concerns."""
-        
-        messages = [{"role": "system", "content": system_message}]
-        
-        if doc_summary:
-            messages.append({"role": "system", "content": f"Medical document analysis: {doc_summary}"})
-        
-        if curacel_context:
-            messages.append({"role": "system", "content": f"Insurance/Claims context: {curacel_context}"})
-        
-        recent_conversation = conversation[-10:] if len(conversation) > 10 else conversation
-        messages += recent_conversation
-        messages.append({"role": "user", "content": message})
 
-        endpoint = AZURE_OPENAI_ENDPOINT.rstrip('/')
-        url = f"{endpoint}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version=2024-12-01-preview"
-        
-        headers = {
-            "Content-Type": "application/json",
-            "api-key": AZURE_OPENAI_KEY
-        }
+TRUNCATION_NOTE = "\n\n[Response truncated due to length limit. Please ask me to continue if you need more information.]"
+
+def azure_chat_completions_url():
+    endpoint = AZURE_OPENAI_ENDPOINT.rstrip('/')
+    return f"{endpoint}/openai/deployments/{AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version=2024-12-01-preview"
+
+# Identical completion requests in flight at the same time share one upstream call.
+azure_openai_calls = SingleFlight()
+
+def _post_azure_chat_completion(data):
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": AZURE_OPENAI_KEY
+    }
+    response = http_client.post("azure_openai", azure_chat_completions_url(), headers=headers, json=data, idempotent=True)
+    response.raise_for_status()
+    return response.json()
+
+def azure_chat_completion(data):
+    key = hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+    return azure_openai_calls.do(key, _post_azure_chat_completion, data)
+
+def build_chat_messages(message, conversation, doc_summary=None, curacel_context=None, history_summary=None,
+                        policy_context=None):
+    messages = [{"role": "system", "content": CHAT_SYSTEM_MESSAGE}]
+    
+    if doc_summary:
+        doc_summary = truncate_to_tokens(doc_summary, DOC_SUMMARY_TOKENS)
+        messages.append({"role": "system", "content": f"Medical document analysis: {doc_summary}"})
+    
+    if curacel_context:
+        messages.append({"role": "system", "content": f"Insurance/Claims context: {curacel_context}"})
+
+    if policy_context:
+        messages.append({"role": "system", "content": f"Relevant excerpts from the user's policy documents:\n{policy_context}"})
+
+    if history_summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {history_summary}"})
+    
+    # Recent turns fill whatever is left of the token budget, newest first.
+    return pack_messages(messages, conversation, {"role": "user", "content": message})
+
+def summarize_conversation(previous_summary, messages):
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    prompt = f"""Update the running summary of a conversation between a user and a health assistant.
+Keep symptoms, medications, values, insurance details and open questions. Be concise (under 150 words).
+
+Current summary:
+{previous_summary or "(none)"}
+
+New messages:
+{transcript}
+
+Updated summary:"""
+    data = {
+        "messages": [
+            {"role": "system", "content": "You maintain concise, factual conversation summaries."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 300,
+        "temperature": 0.2
+    }
+    result = azure_chat_completion(data)
+    return result["choices"][0]["message"]["content"].strip()
+
+def chat_with_bot(message, conversation=[], doc_summary=None, curacel_context=None, history_summary=None,
+                  policy_context=None):
+    try:
+        messages = build_chat_messages(message, conversation, doc_summary, curacel_context, history_summary,
+                                       policy_context)
         
         data = {
             "messages": messages, 
@@ -231,13 +346,11 @@ def chat_with_bot(message, conversation=[], doc_summary=None, curacel_context=No
             "top_p": 0.9
         }
         
-        response = requests.post(url, headers=headers, json=data, timeout=60)
-        response.raise_for_status()
-        result = response.json()
+        result = azure_chat_completion(data)
         content = result["choices"][0]["message"]["content"]
         finish_reason = result["choices"][0]["finish_reason"]
         if finish_reason == "length":
-            content += "\n\n[Response truncated due to length limit. Please ask me to continue if you need more information.]"
+            content += TRUNCATION_NOTE
         return content
     
     except requests.exceptions.Timeout:
@@ -247,6 +360,48 @@ def chat_with_bot(message, conversation=[], doc_summary=None, curacel_context=No
     except Exception as e:
         return f"Unexpected error: {str(e)}"
 
+def chat_with_bot_stream(message, conversation=[], doc_summary=None, curacel_context=None, history_summary=None,
+                         policy_context=None):
+    # Yields content deltas as Azure OpenAI produces them; errors are yielded as text like chat_with_bot.
+    try:
+        messages = build_chat_messages(message, conversation, doc_summary, curacel_context, history_summary,
+                                       policy_context)
+        headers = {
+            "Content-Type": "application/json",
+            "api-key": AZURE_OPENAI_KEY
+        }
+        data = {
+            "messages": messages,
+            "max_tokens": 800,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stream": True
+        }
+        with http_client.post(
+            "azure_openai", azure_chat_completions_url(), headers=headers, json=data, stream=True, idempotent=True
+        ) as response:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                for choice in chunk.get("choices", [])[:1]:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield content
+                    if choice.get("finish_reason") == "length":
+                        yield TRUNCATION_NOTE
+    except requests.exceptions.Timeout:
+        yield "Request timed out. Please try again with a shorter message."
+    except requests.exceptions.RequestException as e:
+        yield f"Error communicating with Azure OpenAI: {str(e)}"
+    except Exception as e:
+        yield f"Unexpected error: {str(e)}"
+
 def create_curacel_claim(claim_data):
     try:
         url = f"{CURACEL_BASE_URL}/api/v1/claims"
@@ -255,7 +410,8 @@ def create_curacel_claim(claim_data):
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
-        response = requests.post(url, headers=headers, json=claim_data, timeout=30)
+        # Creating a claim is not idempotent, so it is never retried.
+        response = http_client.post("curacel", url, headers=headers, json=claim_data, retries=0)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -274,7 +430,8 @@ def get_treatment_cost_estimate(procedure_code, location="Nigeria"):
             "location": location,
             "currency": "NGN"
         }
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        # A lookup, so safe to repeat on a server error.
+        response = http_client.post("curacel", url, headers=headers, json=data, idempotent=True)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -292,27 +449,85 @@ def verify_insurance_coverage(policy_number, procedure_code):
             "policy_number": policy_number,
             "procedure_code": procedure_code
         }
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        # A lookup, so safe to repeat on a server error.
+        response = http_client.post("curacel", url, headers=headers, json=data, idempotent=True)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error verifying coverage: {str(e)}")
         return None
 
-def process_user_request(user_input, conversation, doc_summary=None):
-    insurance_keywords = [
-        "insurance", "claim", "coverage", "policy", "premium", "deductible",
-        "cost", "price", "estimate", "reimburse", "copay", "benefits"
-    ]
-    curacel_context = None
-    if any(keyword in user_input.lower() for keyword in insurance_keywords):
-        if "cost" in user_input.lower() or "price" in user_input.lower():
-            cost_info = get_treatment_cost_estimate("general_consultation")
-            if cost_info:
-                curacel_context = f"Treatment cost information: {json.dumps(cost_info, indent=2)}"
-        elif "coverage" in user_input.lower() or "policy" in user_input.lower():
-            curacel_context = "Insurance coverage verification available. Please provide your policy number for specific coverage details."
-    return chat_with_bot(user_input, conversation, doc_summary, curacel_context)
+COVERAGE_PROMPT = "Insurance coverage verification available. Please provide your policy number for specific coverage details."
+CLAIM_STATUS_PROMPT = "Claim status tracking available. Please provide your claim reference or policy number."
+
+def get_claim_status(insurance_no=None, claim_ref=None):
+    try:
+        url = f"{CURACEL_BASE_URL}/api/v1/claims"
+        headers = {
+            "Authorization": f"Bearer {CURACEL_API_KEY}",
+            "Accept": "application/json"
+        }
+        params = {}
+        if insurance_no:
+            params["insurance_no"] = insurance_no
+        if claim_ref:
+            params["ref"] = claim_ref
+        response = http_client.get("curacel", url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Error getting claim status: {str(e)}")
+        return None
+
+def get_curacel_context(user_input, route=None):
+    # Only the lookups the message's intents need are made.
+    route = route or route_message(user_input)
+    parts = []
+    if COST_ESTIMATE in route.intents:
+        cost_info = get_treatment_cost_estimate("general_consultation")
+        if cost_info:
+            parts.append(f"Treatment cost information: {json.dumps(cost_info, indent=2)}")
+    if COVERAGE_CHECK in route.intents:
+        coverage = verify_insurance_coverage(route.policy_number, "general_consultation") if route.policy_number else None
+        if coverage:
+            parts.append(f"Coverage verification: {json.dumps(coverage, indent=2)}")
+        elif COST_ESTIMATE not in route.intents:
+            parts.append(COVERAGE_PROMPT)
+    if CLAIM_STATUS in route.intents:
+        if route.claim_ref or route.policy_number:
+            claims = get_claim_status(route.policy_number, route.claim_ref)
+            if claims:
+                parts.append(f"Claim status: {json.dumps(claims, indent=2)}")
+        else:
+            parts.append(CLAIM_STATUS_PROMPT)
+    return "\n\n".join(parts) or None
+
+def get_policy_context(user_input, owner_uid):
+    # Top-ranked chunks of the user's own uploaded policies, trimmed to their token share.
+    if not owner_uid:
+        return None
+    try:
+        hits = policy_index.search(user_input, owner_uid=owner_uid)
+    except sqlite3.Error as e:
+        print(f"Error searching policy index: {str(e)}")
+        return None
+    if not hits:
+        return None
+    excerpts = "\n\n".join(f"[{hit['policy_name']}, part {hit['position'] + 1}] {hit['text']}" for hit in hits)
+    return truncate_to_tokens(excerpts, POLICY_CONTEXT_TOKENS)
+
+def process_user_request(user_input, conversation, doc_summary=None, history_summary=None, owner_uid=None):
+    route = route_message(user_input)
+    curacel_context = get_curacel_context(user_input, route)
+    policy_context = get_policy_context(user_input, owner_uid) if route.wants_policy_context else None
+    return chat_with_bot(user_input, conversation, doc_summary, curacel_context, history_summary, policy_context)
+
+def process_user_request_stream(user_input, conversation, doc_summary=None, history_summary=None, owner_uid=None):
+    route = route_message(user_input)
+    curacel_context = get_curacel_context(user_input, route)
+    policy_context = get_policy_context(user_input, owner_uid) if route.wants_policy_context else None
+    yield from chat_with_bot_stream(user_input, conversation, doc_summary, curacel_context, history_summary,
+                                    policy_context)
 
 def show_curacel_menu():
     print("\n=== Curacel Health Insurance Services ===")
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import os
+
+import httpx
+
+import http_client
+from health_assistant import (
+    AZURE_OPENAI_KEY,
+    CLAIM_STATUS_PROMPT,
+    COVERAGE_PROMPT,
+    CURACEL_API_KEY,
+    CURACEL_BASE_URL,
+    TRUNCATION_NOTE,
+    azure_chat_completions_url,
+    build_chat_messages,
+    get_policy_context,
+)
+from intent_router import CLAIM_STATUS, COST_ESTIMATE, COVERAGE_CHECK, route_message
+from outbound_scheduler import SchedulerSaturated
+
+# One event loop can keep this many upstream requests open at once.
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", 200))
+ASYNC_LLM_CONCURRENCY = int(os.environ.get("ASYNC_LLM_CONCURRENCY", 100))
+ASYNC_LLM_QUEUE_SIZE = int(os.environ.get("ASYNC_LLM_QUEUE_SIZE", 400))
+
+_clients = {}
+
+
+def _client(upstream):
+    # Clients are bound to the running loop; the ASGI app has one loop per process.
+    client = _clients.get(upstream)
+    if client is None:
+        settings = http_client.upstream(upstream)
+        connect_timeout, read_timeout = settings.timeout
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=50),
+            transport=httpx.AsyncHTTPTransport(retries=settings.max_retries),
+        )
+        _clients[upstream] = client
+    return client
+
+
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(*(client.aclose() for client in clients))
+
+
+class AsyncSlots:
+    """Caps in-flight LLM conversations on the loop and rejects with 429 once the wait list is full."""
+
+    def __init__(self, name, limit, max_waiting):
+        self.name = name
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                raise SchedulerSaturated(self.name, 429, 1)
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+llm_slots = AsyncSlots("azure_openai", ASYNC_LLM_CONCURRENCY, ASYNC_LLM_QUEUE_SIZE)
+
+
+class BreakerCall:
+    """Admits one call through an upstream's circuit breaker and always settles it.
+
+    Call settle() with the response. Leaving the block without a response
+    records a failure, or only frees a half-open trial if the task was cancelled.
+    """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.breaker = http_client.upstream(upstream).breaker
+        self.settled = False
+
+    def __enter__(self):
+        wait = self.breaker.before_call()
+        if wait is not None:
+            raise http_client.CircuitOpenError(self.upstream, wait)
+        return self
+
+    def settle(self, response):
+        self.settled = True
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.settled:
+            self.settled = True
+            if exc_type is None or issubclass(exc_type, asyncio.CancelledError):
+                self.breaker.release_trial()
+            else:
+                self.breaker.record_failure()
+        return False
+
+
+async def _request(upstream, method, url, **kwargs):
+    # Shares the sync client's circuit breaker so both paths fail fast together.
+    with BreakerCall(upstream) as call:
+        response = await _client(upstream).request(method, url, **kwargs)
+        call.settle(response)
+    return response
+
+
+async def _post(upstream, url, **kwargs):
+    return await _request(upstream, "POST", url, **kwargs)
+
+
+async def get_treatment_cost_estimate_async(procedure_code, location="Nigeria"):
+    try:
+        url = f"{CURACEL_BASE_URL}/api/v1/estimates"
+        headers = {
+            "Authorization": f"Bearer {CURACEL_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "procedure_code": procedure_code,
+            "location": location,
+            "currency": "NGN"
+        }
+        response = await _post("curacel", url, headers=headers, json=data)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, http_client.CircuitOpenError) as e:
+        print(f"Error getting cost estimate: {str(e)}")
+        return None
+
+
+async def verify_insurance_coverage_async(policy_number, procedure_code):
+    try:
+        url = f"{CURACEL_BASE_URL}/api/v1/coverage/verify"
+        headers = {
+            "Authorization": f"Bearer {CURACEL_API_KEY}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "policy_number": policy_number,
+            "procedure_code": procedure_code
+        }
+        response = await _post("curacel", url, headers=headers, json=data)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, http_client.CircuitOpenError) as e:
+        print(f"Error verifying coverage: {str(e)}")
+        return None
+
+
+async def get_claim_status_async(insurance_no=None, claim_ref=None):
+    try:
+        url = f"{CURACEL_BASE_URL}/api/v1/claims"
+        headers = {
+            "Authorization": f"Bearer {CURACEL_API_KEY}",
+            "Accept": "application/json"
+        }
+        params = {}
+        if insurance_no:
+            params["insurance_no"] = insurance_no
+        if claim_ref:
+            params["ref"] = claim_ref
+        response = await _request("curacel", "GET", url, headers=headers, params=params)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, http_client.CircuitOpenError) as e:
+        print(f"Error getting claim status: {str(e)}")
+        return None
+
+
+async def get_curacel_context_async(user_input, route=None):
+    # Unlike the sync flow, the lookups the intents need run concurrently.
+    route = route or route_message(user_input)
+    lookups = {}
+    if COST_ESTIMATE in route.intents:
+        lookups["cost"] = get_treatment_cost_estimate_async("general_consultation")
+    if COVERAGE_CHECK in route.intents and route.policy_number:
+        lookups["coverage"] = verify_insurance_coverage_async(route.policy_number, "general_consultation")
+    if CLAIM_STATUS in route.intents and (route.claim_ref or route.policy_number):
+        lookups["claims"] = get_claim_status_async(route.policy_number, route.claim_ref)
+    results = dict(zip(lookups, await asyncio.gather(*lookups.values())))
+
+    parts = []
+    if results.get("cost"):
+        parts.append(f"Treatment cost information: {json.dumps(results['cost'], indent=2)}")
+    if results.get("coverage"):
+        parts.append(f"Coverage verification: {json.dumps(results['coverage'], indent=2)}")
+    elif COVERAGE_CHECK in route.intents and COST_ESTIMATE not in route.intents:
+        parts.append(COVERAGE_PROMPT)
+    if results.get("claims"):
+        parts.append(f"Claim status: {json.dumps(results['claims'], indent=2)}")
+    elif CLAIM_STATUS in route.intents and "claims" not in lookups:
+        parts.append(CLAIM_STATUS_PROMPT)
+    return "\n\n".join(parts) or None
+
+
+def _chat_request(message, conversation, doc_summary, curacel_context, history_summary, policy_context,
+                  stream=False):
+    data = {
+        "messages": build_chat_messages(message, conversation, doc_summary, curacel_context, history_summary,
+                                        policy_context),
+        "max_tokens": 800,
+        "temperature": 0.7,
+        "top_p": 0.9
+    }
+    if stream:
+        data["stream"] = True
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": AZURE_OPENAI_KEY
+    }
+    return headers, data
+
+
+async def chat_with_bot_async(message, conversation=[], doc_summary=None, curacel_context=None, history_summary=None,
+                              policy_context=None):
+    try:
+        headers, data = _chat_request(message, conversation, doc_summary, curacel_context, history_summary,
+                                      policy_context)
+        response = await _post("azure_openai", azure_chat_completions_url(), headers=headers, json=data)
+        response.raise_for_status()
+        result = response.json()
+        content = result["choices"][0]["message"]["content"]
+        if result["choices"][0]["finish_reason"] == "length":
+            content += TRUNCATION_NOTE
+        return content
+    except httpx.TimeoutException:
+        return "Request timed out. Please try again with a shorter message."
+    except (httpx.HTTPError, http_client.CircuitOpenError) as e:
+        return f"Error communicating with Azure OpenAI: {str(e)}"
+    except Exception as e:
+        return f"Unexpected error: {str(e)}"
+
+
+async def chat_with_bot_stream_async(message, conversation=[], doc_summary=None, curacel_context=None,
+                                     history_summary=None, policy_context=None):
+    try:
+        headers, data = _chat_request(message, conversation, doc_summary, curacel_context, history_summary,
+                                      policy_context, stream=True)
+        with BreakerCall("azure_openai") as call:
+            async with _client("azure_openai").stream(
+                "POST", azure_chat_completions_url(), headers=headers, json=data
+            ) as response:
+                call.settle(response)
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    for choice in chunk.get("choices", [])[:1]:
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            yield content
+                        if choice.get("finish_reason") == "length":
+                            yield TRUNCATION_NOTE
+    except httpx.TimeoutException:
+        yield "Request timed out. Please try again with a shorter message."
+    except (httpx.HTTPError, http_client.CircuitOpenError) as e:
+        yield f"Error communicating with Azure OpenAI: {str(e)}"
+    except Exception as e:
+        yield f"Unexpected error: {str(e)}"
+
+
+async def _request_context(user_input, owner_uid):
+    route = route_message(user_input)
+    if not route.wants_policy_context:
+        return await get_curacel_context_async(user_input, route), None
+    # The policy index is a local SQLite file; search it on a thread while Curacel is queried.
+    return await asyncio.gather(
+        get_curacel_context_async(user_input, route),
+        asyncio.to_thread(get_policy_context, user_input, owner_uid),
+    )
+
+
+async def process_user_request_async(user_input, conversation, doc_summary=None, history_summary=None, owner_uid=None):
+    curacel_context, policy_context = await _request_context(user_input, owner_uid)
+    return await chat_with_bot_async(user_input, conversation, doc_summary, curacel_context, history_summary,
+                                     policy_context)
+
+
+async def process_user_request_stream_async(user_input, conversation, doc_summary=None, history_summary=None,
+                                            owner_uid=None):
+    curacel_context, policy_context = await _request_context(user_input, owner_uid)
+    async for text in chat_with_bot_stream_async(user_input, conversation, doc_summary, curacel_context,
+                                                 history_summary, policy_context):
+        yield text
@@ -0,0 +1,223 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Defaults for every upstream; override per upstream with e.g. HTTP_READ_TIMEOUT_GEMINI.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 2))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", 0.5))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", 8))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get("BREAKER_RESET_TIMEOUT", 30))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A 5xx may come after the request took effect, so only these methods are retried on one by
+# default; a POST that is safe to repeat (a lookup, a completion) passes idempotent=True.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Read timeouts that differ from HTTP_READ_TIMEOUT unless overridden in the environment.
+DEFAULT_READ_TIMEOUTS = {
+    "curacel": 30,
+}
+
+
+def _setting(name, upstream, default, cast=float):
+    value = os.environ.get(f"{name}_{upstream.upper()}")
+    return cast(value) if value is not None else default
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    def __init__(self, upstream, retry_after):
+        self.upstream = upstream
+        self.retry_after = retry_after
+        super().__init__(f"Circuit open for {upstream}; retry in {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        # Returns None if the call may proceed, otherwise seconds until the next trial.
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return None
+            return max(remaining, 1.0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        # For calls that ended without a verdict (e.g. cancelled): the next caller may run the trial.
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+
+class Upstream:
+    """Keep-alive session, timeouts, retries and a circuit breaker for one upstream service."""
+
+    def __init__(self, name):
+        self.name = name
+        self.timeout = (
+            _setting("HTTP_CONNECT_TIMEOUT", name, HTTP_CONNECT_TIMEOUT),
+            _setting("HTTP_READ_TIMEOUT", name, DEFAULT_READ_TIMEOUTS.get(name, HTTP_READ_TIMEOUT)),
+        )
+        self.max_retries = _setting("HTTP_MAX_RETRIES", name, HTTP_MAX_RETRIES, int)
+        pool_size = _setting("HTTP_POOL_SIZE", name, HTTP_POOL_SIZE, int)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.breaker = CircuitBreaker(
+            _setting("BREAKER_FAILURE_THRESHOLD", name, BREAKER_FAILURE_THRESHOLD, int),
+            _setting("BREAKER_RESET_TIMEOUT", name, BREAKER_RESET_TIMEOUT),
+        )
+        self._lock = threading.Lock()
+        self._metrics = {
+            "requests": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "short_circuited": 0,
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+            "last_error": None,
+        }
+
+    def _count(self, **changes):
+        with self._lock:
+            for key, value in changes.items():
+                self._metrics[key] += value
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), HTTP_BACKOFF_MAX))
+        time.sleep(delay)
+
+    def request(self, method, url, retries=None, idempotent=None, **kwargs):
+        # retries=0 for calls that must not be repeated (e.g. creating a claim). A POST whose
+        # response timed out may already have been processed, so read timeouts are never
+        # retried for POST; that also keeps an LLM call from blocking for several read timeouts.
+        # 429 means the request was turned away, so it is retried whatever the method.
+        kwargs.setdefault("timeout", self.timeout)
+        max_retries = self.max_retries if retries is None else retries
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            wait = self.breaker.before_call()
+            if wait is not None:
+                self._count(short_circuited=1)
+                raise CircuitOpenError(self.name, wait)
+
+            started = time.perf_counter()
+            self._count(requests=1)
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(started, failed=True, error=str(e))
+                if attempt >= max_retries or (method == "POST" and isinstance(e, requests.exceptions.ReadTimeout)):
+                    raise
+                self._count(retries=1)
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except Exception as e:
+                # Anything else (bad URL, broken chunked body, ...) still has to close a half-open trial.
+                self._record(started, failed=True, error=str(e))
+                raise
+
+            failed = response.status_code >= 500
+            self._record(started, failed=failed, error=f"HTTP {response.status_code}" if failed else None)
+            retryable = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUSES)
+            if retryable and attempt < max_retries:
+                response.close()
+                self._count(retries=1)
+                self._backoff(attempt, response)
+                attempt += 1
+                continue
+            return response
+
+    def _record(self, started, failed, error=None):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._metrics["latency_ms_total"] += elapsed_ms
+            self._metrics["latency_ms_max"] = max(self._metrics["latency_ms_max"], elapsed_ms)
+            if failed:
+                self._metrics["failures"] += 1
+                self._metrics["last_error"] = error
+            else:
+                self._metrics["successes"] += 1
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._metrics)
+        completed = snapshot["successes"] + snapshot["failures"]
+        snapshot["latency_ms_avg"] = snapshot["latency_ms_total"] / completed if completed else 0.0
+        snapshot["breaker_state"] = self.breaker.state
+        snapshot["timeout"] = list(self.timeout)
+        return snapshot
+
+
+_upstreams = {}
+_registry_lock = threading.Lock()
+
+
+def upstream(name):
+    with _registry_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name)
+        return _upstreams[name]
+
+
+def get(name, url, **kwargs):
+    return upstream(name).request("GET", url, **kwargs)
+
+
+def post(name, url, **kwargs):
+    return upstream(name).request("POST", url, **kwargs)
+
+
+def upstream_metrics():
+    with _registry_lock:
+        items = list(_upstreams.items())
+    return {name: client.metrics() for name, client in items}
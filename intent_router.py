@@ -0,0 +1,146 @@
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+
+COST_ESTIMATE = "cost_estimate"
+COVERAGE_CHECK = "coverage_check"
+CLAIM_STATUS = "claim_status"
+DOCUMENT_QUESTION = "document_question"
+
+# Intents whose answer may sit in the user's own uploaded policy documents.
+POLICY_CONTEXT_INTENTS = frozenset([COVERAGE_CHECK, DOCUMENT_QUESTION])
+
+# Regex fragments per intent; each is matched case-insensitively as whole words.
+INTENT_PHRASES = {
+    COST_ESTIMATE: [
+        r"costs?", r"costly", r"pric(?:e|es|ing)", r"how much (?:is|are|does|do|will|would|for)", r"estimates?",
+        r"fees?", r"charges?", r"afford", r"expensive", r"cheap(?:er|est)?",
+    ],
+    COVERAGE_CHECK: [
+        # Bare "cover" would catch "cover letter"; it needs a subject or object around it.
+        r"coverage", r"(?:is|are|am|be|been|it|this|that|not|i'm|we're) covered", r"covered (?:by|under|for)",
+        r"(?:does|do|will|would|can|could) (?:\w+ ){0,3}cover", r"covers? (?:me|it|this|that|the|my|costs?)",
+        r"insur(?:ance|ed|er)", r"polic(?:y|ies)", r"premiums?", r"deductibles?",
+        r"co-?pays?", r"benefits?", r"reimburs(?:e|ed|ement)", r"exclusions?", r"hmo",
+    ],
+    CLAIM_STATUS: [
+        r"claims?\b.{0,40}\b(?:status|approved|pending|rejected|denied|paid|processed|progress|update)",
+        r"(?:status|track(?:ing)?|follow up on|update on|progress (?:of|on))\b.{0,30}\bclaims?",
+        r"claims? (?:ref(?:erence)?|number|no\.?|id)",
+    ],
+    DOCUMENT_QUESTION: [
+        r"documents?", r"reports?", r"results?", r"lab(?:s| test| tests)?", r"scans?", r"x-?ray", r"letter",
+        r"discharge", r"prescriptions?", r"upload(?:ed)?", r"files?", r"according to", r"does it say", r"mentions?",
+        r"my (?:policy|plan)", r"waiting period",
+    ],
+}
+
+POLICY_NUMBER_PATTERN = re.compile(
+    r"policy\s*(?:number|no\.?|#)?\s*[:#]?\s*((?=[A-Z0-9-]*\d)[A-Z0-9][A-Z0-9-]{4,})",
+    re.IGNORECASE,
+)
+CLAIM_REF_PATTERN = re.compile(
+    r"claim\s*(?:ref(?:erence)?|number|no\.?|id|#)\s*[:#]?\s*((?=[A-Z0-9-]*\d)[A-Z0-9][A-Z0-9-]{4,})",
+    re.IGNORECASE,
+)
+
+# The classifier only runs when no phrase matched; it is off unless enabled.
+INTENT_CLASSIFIER = os.environ.get("INTENT_CLASSIFIER", "").lower() in ("1", "true", "yes")
+INTENT_CLASSIFIER_THRESHOLD = float(os.environ.get("INTENT_CLASSIFIER_THRESHOLD", 0.6))
+INTENT_EXAMPLES_PATH = os.environ.get(
+    "INTENT_EXAMPLES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "intent_examples.json")
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class Route(namedtuple("Route", "intents policy_number claim_ref")):
+    @property
+    def wants_policy_context(self):
+        return not self.intents.isdisjoint(POLICY_CONTEXT_INTENTS)
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over word counts, trained from {label: [example, ...]}.
+
+    Examples under the "other" label teach it what is not an intent.
+    """
+
+    def __init__(self, examples):
+        self.labels = list(examples)
+        counts = {label: Counter(w for text in texts for w in WORD_PATTERN.findall(text.lower()))
+                  for label, texts in examples.items()}
+        vocabulary = set().union(*counts.values())
+        total = sum(len(texts) for texts in examples.values())
+        self.priors = {label: math.log(len(texts) / total) for label, texts in examples.items()}
+        self.word_logs = {}
+        self.unknown_logs = {}
+        for label, label_counts in counts.items():
+            denominator = sum(label_counts.values()) + len(vocabulary)
+            self.word_logs[label] = {w: math.log((n + 1) / denominator) for w, n in label_counts.items()}
+            self.unknown_logs[label] = math.log(1 / denominator)
+
+    def predict(self, text):
+        """Returns (label, probability) for the most likely label."""
+        words = WORD_PATTERN.findall(text.lower())
+        scores = {}
+        for label in self.labels:
+            word_logs = self.word_logs[label]
+            unknown = self.unknown_logs[label]
+            scores[label] = self.priors[label] + sum(word_logs.get(w, unknown) for w in words)
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+
+def load_classifier(path=INTENT_EXAMPLES_PATH):
+    with open(path, encoding="utf-8") as f:
+        return NaiveBayesClassifier(json.load(f))
+
+
+class IntentRouter:
+    """Maps a message to the set of intents it expresses, with one compiled regex per intent.
+
+    Intents can be added with register(), which recompiles the patterns.
+    """
+
+    def __init__(self, phrases, classifier=None, threshold=INTENT_CLASSIFIER_THRESHOLD):
+        self.phrases = {intent: list(fragments) for intent, fragments in phrases.items()}
+        self.classifier = classifier
+        self.threshold = threshold
+        self._compile()
+
+    def _compile(self):
+        # One pattern per intent: a single alternation consumes each match, so a
+        # long CLAIM_STATUS span would hide the cost or coverage words inside it.
+        self.patterns = {
+            intent: re.compile(rf"\b(?:{'|'.join(fragments)})\b", re.IGNORECASE)
+            for intent, fragments in self.phrases.items()
+        }
+
+    def register(self, intent, fragments):
+        self.phrases.setdefault(intent, []).extend(fragments)
+        self._compile()
+
+    def route(self, message):
+        intents = {intent for intent, pattern in self.patterns.items() if pattern.search(message)}
+        if not intents and self.classifier is not None:
+            label, probability = self.classifier.predict(message)
+            if label in self.phrases and probability >= self.threshold:
+                intents.add(label)
+        policy_match = POLICY_NUMBER_PATTERN.search(message) if intents & {COVERAGE_CHECK, CLAIM_STATUS} else None
+        claim_match = CLAIM_REF_PATTERN.search(message) if CLAIM_STATUS in intents else None
+        return Route(
+            frozenset(intents),
+            policy_match.group(1) if policy_match else None,
+            claim_match.group(1) if claim_match else None,
+        )
+
+
+router = IntentRouter(INTENT_PHRASES, classifier=load_classifier() if INTENT_CLASSIFIER else None)
+
+
+def route_message(message):
+    return router.route(message)
@@ -0,0 +1,219 @@
+import glob
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from cache import CACHE_DIR
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+# Uploaded files waiting for a worker; kept outside the database so it stays small.
+JOB_FILES_DIR = os.environ.get("JOB_FILES_DIR", os.path.join(CACHE_DIR, "job_files"))
+# A worker must renew its lease within this time or the job is handed to another worker.
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 24 * 3600))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Persistent job queue in a SQLite file shared by the web and worker processes.
+
+    Workers claim jobs with a lease and renew it while they work. A job whose
+    lease runs out (its worker crashed or hung) is claimed again by another
+    worker, up to JOB_MAX_ATTEMPTS times.
+
+    Jobs may carry a dedupe key (for uploads, the content digest). A queued
+    job is not claimed while another job with the same key is running, so
+    identical work is done once and the later job finds its result cached.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        os.makedirs(JOB_FILES_DIR, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    owner_uid TEXT,
+                    payload TEXT NOT NULL,
+                    dedupe_key TEXT,
+                    file_bytes INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_expires_at REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key, status)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def file_path(self, job_id, extension=""):
+        return os.path.join(JOB_FILES_DIR, f"{job_id}{extension}")
+
+    def enqueue(self, kind, payload, owner_uid=None, job_id=None, dedupe_key=None, file_bytes=0):
+        """Queues a job; ``file_bytes`` is the size of its files under file_path(), freed when it finishes."""
+        job_id = job_id or self.new_id()
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner_uid, payload, dedupe_key, file_bytes, status, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, owner_uid, json.dumps(payload), dedupe_key, file_bytes, QUEUED, now, now),
+            )
+        return job_id
+
+    def _remove_files(self, job_id):
+        # Every file of a job is named after it by file_path(); ids are fixed-length, so the prefix is exact.
+        for path in glob.glob(os.path.join(JOB_FILES_DIR, glob.escape(job_id) + "*")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def pending_file_bytes(self):
+        """Bytes of job files still waiting for, or being read by, a worker."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COALESCE(SUM(file_bytes), 0) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+
+    def find_active(self, kind, dedupe_key, owner_uid=None):
+        """Id of the owner's queued or running job with this dedupe key, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE dedupe_key = ? AND kind = ? AND owner_uid IS ? AND status IN (?, ?) "
+                "ORDER BY created_at LIMIT 1",
+                (dedupe_key, kind, owner_uid, QUEUED, RUNNING),
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def _job(self, row):
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def claim(self, worker):
+        """Leases the oldest runnable job to ``worker``; returns it, or None if there is none."""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            while True:
+                now = time.time()
+                # IMMEDIATE takes the write lock up front so two workers never claim the same job.
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT * FROM jobs AS j WHERE (status = ? OR (status = ? AND lease_expires_at < ?)) "
+                    "AND NOT EXISTS (SELECT 1 FROM jobs AS r WHERE j.dedupe_key IS NOT NULL "
+                    "AND r.dedupe_key = j.dedupe_key AND r.id != j.id AND r.status = ? AND r.lease_expires_at >= ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, row["error"] or f"Gave up after {row['attempts']} attempts", now, row["id"]),
+                    )
+                    conn.commit()
+                    self._remove_files(row["id"])
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (RUNNING, worker, now + JOB_LEASE_SECONDS, now, row["id"]),
+                )
+                conn.commit()
+                job = self._job(row)
+                job.update(status=RUNNING, worker=worker, attempts=row["attempts"] + 1)
+                return job
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id, worker):
+        """Renews the lease; False means the job was taken over and the worker should stop."""
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (time.time() + JOB_LEASE_SECONDS, job_id, worker, RUNNING),
+            ).rowcount
+        return bool(updated)
+
+    def complete(self, job_id, worker, result):
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND status = ?",
+                (DONE, json.dumps(result), time.time(), job_id, worker, RUNNING),
+            ).rowcount
+        if updated:
+            self._remove_files(job_id)
+
+    def fail(self, job_id, worker, error):
+        # Requeued, files and all, until the attempts run out; claim() marks it failed after that.
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, "
+                "lease_expires_at = NULL, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+                (JOB_MAX_ATTEMPTS, FAILED, QUEUED, error, time.time(), job_id, worker, RUNNING),
+            ).rowcount
+            failed = updated and conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == FAILED
+        if failed:
+            self._remove_files(job_id)
+
+    def purge(self, older_than=JOB_RETENTION):
+        """Drops finished jobs and orphaned upload files older than ``older_than`` seconds."""
+        cutoff = time.time() - older_than
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff)
+            )
+        for name in os.listdir(JOB_FILES_DIR):
+            path = os.path.join(JOB_FILES_DIR, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+        return {
+            "counts": {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)},
+            "oldest_queued_seconds": round(time.time() - oldest, 1) if oldest else 0,
+            "pending_file_bytes": self.pending_file_bytes(),
+        }
+
+
+job_queue = JobQueue()
@@ -0,0 +1,140 @@
+import json
+import os
+import re
+from collections import deque
+
+MEDICAL_LEXICON_PATH = os.environ.get(
+    "MEDICAL_LEXICON_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "medical_lexicon.json")
+)
+
+# Lower-cases ASCII only, so offsets in the folded text are offsets in the original.
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+NUMBER = r"(?<![\w.])\d+(?:[.,]\d+)?"
+MEASUREMENT_UNITS = [
+    "mg/dL", "mg/dl", "g/dL", "g/dl", "g/L", "mmol/L", "mmol/l", "µmol/L", "umol/L", "mEq/L", "U/L", "IU/L",
+    "ng/mL", "ng/ml", "pg/mL", "pg/ml", "mIU/L", "µIU/mL", "uIU/mL", "x10^9/L", "×10^9/L", "x10^12/L", "×10^12/L",
+    "cells/µL", "cells/uL", "cells/mm3", "copies/mL", "mL/min", "fL", "%", "mmHg", "bpm", "beats/min",
+    "breaths/min", "/min", "°C", "°F", "kg/m2", "kg", "cm",
+]
+DOSE_UNITS = ["mg", "mcg", "µg", "ug", "g", "mL", "ml", "IU", "units", "unit", "mEq", "tablets", "tablet", "tabs",
+              "capsules", "capsule", "puffs", "drops"]
+
+
+def _units(units):
+    # Longest first, so "mg/dL" wins over "mg" at the same position.
+    return "|".join(re.escape(unit) for unit in sorted(units, key=len, reverse=True))
+
+
+VALUE_PATTERN = re.compile(
+    rf"(?P<MeasurementValue>(?<![\w.])\d{{2,3}}/\d{{2,3}}\s?mmHg|{NUMBER}\s?(?:{_units(MEASUREMENT_UNITS)})(?![\w/]))"
+    rf"|(?P<Dosage>{NUMBER}\s?(?:{_units(DOSE_UNITS)})(?![\w/]))"
+)
+FREQUENCY_PATTERN = re.compile(
+    r"\b(?:(?:once|twice|three times|four times) (?:a |per )?(?:day|daily|week|weekly)"
+    r"|every \d{1,2} hours|q\s?\d{1,2}\s?h(?:ours|rs|r)?|bid|tid|tds|qid|qds|qhs|prn|nocte|daily)\b",
+    re.IGNORECASE,
+)
+
+
+class Automaton:
+    """Aho-Corasick automaton over a {term: category} lexicon, matched case-insensitively on word boundaries.
+
+    The failure links are folded into each state's transitions up front, so
+    scanning is a single dict lookup per character.
+    """
+
+    def __init__(self, terms):
+        goto = [{}]
+        outputs = [()]
+        for term, category in terms.items():
+            term = term.translate(_ASCII_LOWER)
+            state = 0
+            for ch in term:
+                if ch not in goto[state]:
+                    goto.append({})
+                    outputs.append(())
+                    goto[state][ch] = len(goto) - 1
+                state = goto[state][ch]
+            outputs[state] = ((len(term), category),)
+
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # Transitions missing here are the ones of the failure state.
+            delta[state] = dict(delta[fail[state]])
+            for ch, child in goto[state].items():
+                fail[child] = delta[fail[state]].get(ch, 0)
+                delta[state][ch] = child
+                outputs[child] += outputs[fail[child]]
+                queue.append(child)
+        self.delta = delta
+        self.outputs = outputs
+
+    def matches(self, text):
+        """Yields (start, end, category) for every lexicon term in text, overlapping ones included."""
+        folded = text.translate(_ASCII_LOWER)
+        delta = self.delta
+        outputs = self.outputs
+        state = 0
+        for end, ch in enumerate(folded, 1):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for length, category in outputs[state]:
+                    start = end - length
+                    if (start == 0 or not folded[start - 1].isalnum()) and (end == len(folded) or not folded[end].isalnum()):
+                        yield start, end, category
+
+
+def load_lexicon(path=MEDICAL_LEXICON_PATH):
+    with open(path, encoding="utf-8") as f:
+        lexicon = json.load(f)
+    return {term: category for category, terms in lexicon.items() for term in terms}
+
+
+lexicon = Automaton(load_lexicon())
+
+
+def _entity(text, start, end, category):
+    return {"text": text[start:end], "category": category, "offset": start, "length": end - start,
+            "confidenceScore": 1.0}
+
+
+def merge_entities(*entity_lists):
+    """Entities from all lists in text order, each (category, text) pair kept once."""
+    entities = []
+    seen = set()
+    for entity in sorted((e for entities in entity_lists for e in entities), key=lambda e: e["offset"]):
+        key = (entity["category"], entity["text"].lower())
+        if key not in seen:
+            seen.add(key)
+            entities.append(entity)
+    return entities
+
+
+def extract_entities(text):
+    """Medication and examination names, doses, frequencies and measured values found in text.
+
+    Entities use the same fields as Azure Health Text Analytics, so results
+    from both can be merged and summarized alike.
+    """
+    matches = []
+    # Longest match wins where lexicon terms overlap, e.g. "insulin glargine" over "insulin".
+    covered_to = 0
+    for start, end, category in sorted(lexicon.matches(text), key=lambda m: (m[0], -m[1])):
+        if start >= covered_to:
+            matches.append(_entity(text, start, end, category))
+            covered_to = end
+    for match in VALUE_PATTERN.finditer(text):
+        matches.append(_entity(text, match.start(), match.end(), match.lastgroup))
+    for match in FREQUENCY_PATTERN.finditer(text):
+        matches.append(_entity(text, match.start(), match.end(), "Frequency"))
+    return merge_entities(matches)
+
+
+def summarize_entities(entities):
+    if not entities:
+        return "No medical entities found."
+    return "; ".join(f"{e['category']}: {e['text']}" for e in entities)
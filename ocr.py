@@ -0,0 +1,112 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+from PIL import Image, ImageOps, ImageSequence
+
+# pytesseract runs one tesseract process per call; keep each to a single thread and
+# get the parallelism from running several tiles at once instead.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 2))
+OCR_TARGET_DPI = int(os.environ.get("OCR_TARGET_DPI", 300))
+# Longest side after normalizing: an A4 page at 300 DPI. Phone photos carry no useful DPI.
+OCR_MAX_DIMENSION = int(os.environ.get("OCR_MAX_DIMENSION", 3508))
+OCR_DESKEW_MAX_ANGLE = float(os.environ.get("OCR_DESKEW_MAX_ANGLE", 5))
+OCR_DESKEW_STEP = 0.5
+# Pages taller than 1.5x this are cut into horizontal bands at blank rows between lines.
+OCR_TILE_HEIGHT = int(os.environ.get("OCR_TILE_HEIGHT", 1200))
+
+_DESKEW_SAMPLE_WIDTH = 1000
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="ocr")
+        return _pool
+
+
+def _row_profile(image):
+    # Resizing to one pixel wide averages every row.
+    return list(image.resize((1, image.height), Image.Resampling.BOX).getdata())
+
+
+def _skew_angle(image):
+    scale = min(1.0, _DESKEW_SAMPLE_WIDTH / image.width)
+    sample = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+    # Text white on black, so rotating in black corners adds nothing to the profile.
+    sample = sample.point(lambda p: 255 if p < 128 else 0)
+    best_angle, best_score = 0.0, -1
+    steps = int(OCR_DESKEW_MAX_ANGLE / OCR_DESKEW_STEP)
+    for step in range(-steps, steps + 1):
+        angle = step * OCR_DESKEW_STEP
+        profile = _row_profile(sample.rotate(angle, fillcolor=0))
+        # Rows line up with text lines when the profile alternates most sharply.
+        score = sum((a - b) ** 2 for a, b in zip(profile, profile[1:]))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def normalize(image, dpi=None):
+    """Grayscale, downscale to OCR_TARGET_DPI (or OCR_MAX_DIMENSION) and deskew."""
+    image = ImageOps.exif_transpose(image)
+    image = ImageOps.grayscale(image)
+    if dpi is None:
+        dpi = (image.info.get("dpi") or (0, 0))[0]
+    scale = OCR_TARGET_DPI / dpi if dpi and dpi > OCR_TARGET_DPI else 1.0
+    scale = min(scale, OCR_MAX_DIMENSION / max(image.size))
+    if scale < 1.0:
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    angle = _skew_angle(image)
+    if angle:
+        image = image.rotate(angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+    return image
+
+
+def split_tiles(image):
+    """Cuts a tall page into bands top to bottom, at the blankest row near each boundary."""
+    if image.height <= OCR_TILE_HEIGHT * 1.5:
+        return [image]
+    profile = _row_profile(image)
+    band = OCR_TILE_HEIGHT // 5
+    tiles = []
+    top = 0
+    while image.height - top > OCR_TILE_HEIGHT * 1.5:
+        target = top + OCR_TILE_HEIGHT
+        cut = max(range(target - band, target + band), key=lambda y: (profile[y], -abs(y - target)))
+        tiles.append(image.crop((0, top, image.width, cut)))
+        top = cut
+    tiles.append(image.crop((0, top, image.width, image.height)))
+    return tiles
+
+
+def _recognize(tile):
+    return pytesseract.image_to_string(tile, lang="eng").strip()
+
+
+def ocr_image(image, dpi=None, parallel=True):
+    """OCRs every frame of an image, tile by tile, and stitches the text back in reading order.
+
+    Set parallel=False when already running inside a worker pool.
+    """
+    tiles = []
+    for frame in ImageSequence.Iterator(image):
+        tiles.extend(split_tiles(normalize(frame, dpi)))
+    if parallel and len(tiles) > 1:
+        texts = list(_executor().map(_recognize, tiles))
+    else:
+        texts = [_recognize(tile) for tile in tiles]
+    return "\n".join(text for text in texts if text)
+
+
+def ocr_image_file(path):
+    with Image.open(path) as image:
+        return ocr_image(image)
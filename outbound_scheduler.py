@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 10
+
+OUTBOUND_CONCURRENCY = int(os.environ.get("OUTBOUND_CONCURRENCY", 4))
+# Every waiter holds a web thread (gunicorn --threads $WEB_THREADS), so queues stay well
+# below that count and waits stay short; other routes always keep threads to run on.
+WEB_THREADS = int(os.environ.get("WEB_THREADS", 8))
+OUTBOUND_QUEUE_SIZE = int(os.environ.get("OUTBOUND_QUEUE_SIZE", max(1, WEB_THREADS // 4)))
+OUTBOUND_QUEUE_TIMEOUT = float(os.environ.get("OUTBOUND_QUEUE_TIMEOUT", 2))
+
+
+class SchedulerSaturated(Exception):
+    """Raised when outbound work cannot be admitted; ``status`` is 429 (queue full or evicted) or 503 (deadline passed)."""
+
+    def __init__(self, upstream, status, retry_after):
+        self.upstream = upstream
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(f"{upstream} is busy, retry in {retry_after}s")
+
+
+class _Waiter:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+        self.evicted = False
+
+
+class UpstreamLimiter:
+    """Caps concurrent calls to one upstream and queues the rest by priority, then arrival.
+
+    When the queue is full, a caller evicts the newest waiter of a lower
+    priority, which gets the 429 instead; bulk work never locks out
+    interactive calls.
+    """
+
+    def __init__(self, name, max_concurrency, max_queue):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.avg_hold = 1.0
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        backlog = (self.queued + self.active) / max(self.max_concurrency, 1)
+        return max(1, int(round(backlog * self.avg_hold)))
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=OUTBOUND_QUEUE_TIMEOUT):
+        with self._lock:
+            if self.active < self.max_concurrency and not self.queued:
+                self.active += 1
+                return
+            if self.queued >= self.max_queue and not self._evict_below(priority):
+                self.rejected += 1
+                raise SchedulerSaturated(self.name, 429, self.retry_after())
+            waiter = _Waiter(time.monotonic() + timeout)
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+            self.queued += 1
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.granted:
+                return
+            if waiter.evicted:
+                raise SchedulerSaturated(self.name, 429, self.retry_after())
+            waiter.cancelled = True
+            self.queued -= 1
+            self.timed_out += 1
+            raise SchedulerSaturated(self.name, 503, self.retry_after())
+
+    def _evict_below(self, priority):
+        # Caller holds the lock. The heap is small (at most max_queue live entries), so a scan is fine.
+        candidates = [entry for entry in self._heap if not entry[2].cancelled and entry[0] > priority]
+        if not candidates:
+            return False
+        _, _, waiter = max(candidates, key=lambda entry: (entry[0], entry[1]))
+        waiter.cancelled = waiter.evicted = True
+        self.queued -= 1
+        self.rejected += 1
+        waiter.event.set()
+        return True
+
+    def release(self, held_for=None):
+        with self._lock:
+            if held_for is not None:
+                self.avg_hold = 0.8 * self.avg_hold + 0.2 * held_for
+            now = time.monotonic()
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled or waiter.deadline <= now:
+                    continue
+                # Hand the slot straight to the waiter; ``active`` is unchanged.
+                waiter.granted = True
+                self.queued -= 1
+                waiter.event.set()
+                return
+            self.active -= 1
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE, timeout=OUTBOUND_QUEUE_TIMEOUT):
+        self.acquire(priority, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self.active,
+                "queued": self.queued,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_hold_seconds": round(self.avg_hold, 3),
+            }
+
+
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def limiter(name):
+    # Per-upstream caps come from OUTBOUND_CONCURRENCY_<NAME> / OUTBOUND_QUEUE_SIZE_<NAME>.
+    with _registry_lock:
+        if name not in _limiters:
+            _limiters[name] = UpstreamLimiter(
+                name,
+                int(os.environ.get(f"OUTBOUND_CONCURRENCY_{name.upper()}", OUTBOUND_CONCURRENCY)),
+                int(os.environ.get(f"OUTBOUND_QUEUE_SIZE_{name.upper()}", OUTBOUND_QUEUE_SIZE)),
+            )
+        return _limiters[name]
+
+
+def slot(name, priority=PRIORITY_INTERACTIVE, timeout=OUTBOUND_QUEUE_TIMEOUT):
+    return limiter(name).slot(priority, timeout)
+
+
+def scheduler_stats():
+    with _registry_lock:
+        items = list(_limiters.items())
+    return {name: item.stats() for name, item in items}
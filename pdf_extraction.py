@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz  # PyMuPDF
+import PyPDF2
+from PIL import Image
+
+from ocr import ocr_image
+
+# Large PDFs are split into page ranges and extracted across a process pool.
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", os.cpu_count() or 2))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", 16))
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+# Pages whose text layer has fewer characters than this are treated as scanned and OCRed.
+PDF_MIN_PAGE_CHARS = int(os.environ.get("PDF_MIN_PAGE_CHARS", 20))
+PDF_OCR_DPI = int(os.environ.get("PDF_OCR_DPI", 300))
+PDF_OCR_ENABLED = os.environ.get("PDF_OCR", "1").lower() not in ("0", "false", "no")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pymupdf_pages(path, start, stop):
+    with fitz.open(path) as doc:
+        return [(number, doc[number].get_text()) for number in range(start, stop)]
+
+
+def _pypdf2_pages(path, start, stop):
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(number, reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+
+def _ocr_page(path, number):
+    with fitz.open(path) as doc:
+        pixmap = doc[number].get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    # Pages already run one per pool worker, so the tiles of a page are OCRed in sequence.
+    return ocr_image(image, dpi=PDF_OCR_DPI, parallel=False)
+
+
+_BACKEND_PAGES = {"pymupdf": _pymupdf_pages, "pypdf2": _pypdf2_pages}
+
+
+def page_count(path):
+    try:
+        with fitz.open(path) as doc:
+            return doc.page_count
+    except Exception:
+        with open(path, "rb") as f:
+            return len(PyPDF2.PdfReader(f).pages)
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers: forking a process that runs background threads can deadlock.
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def _page_ranges(pages):
+    return [(start, min(start + PDF_PAGES_PER_TASK, pages)) for start in range(0, pages, PDF_PAGES_PER_TASK)]
+
+
+def iter_pdf_pages(path, backend="pymupdf"):
+    """Yields (page_number, text) as page ranges finish, which is not necessarily page order."""
+    extract = _BACKEND_PAGES[backend]
+    pages = page_count(path)
+    if pages < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+        for start, stop in _page_ranges(pages):
+            yield from extract(path, start, stop)
+        return
+    futures = [_executor().submit(extract, path, start, stop) for start, stop in _page_ranges(pages)]
+    try:
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_pdf_pages_with_ocr(path):
+    """Like iter_pdf_pages with PyMuPDF, but pages without a text layer are OCRed.
+
+    Only those pages are rasterized, and their OCR starts as soon as the text
+    pass reaches them. Pages with text are yielded straight away.
+    """
+    ocr_futures = {}
+    try:
+        for number, text in iter_pdf_pages(path, "pymupdf"):
+            if PDF_OCR_ENABLED and len(text.strip()) < PDF_MIN_PAGE_CHARS:
+                ocr_futures[_executor().submit(_ocr_page, path, number)] = (number, text)
+            else:
+                yield number, text
+        if ocr_futures:
+            print(f"Running OCR on {len(ocr_futures)} scanned PDF pages...")
+        for future in as_completed(ocr_futures):
+            number, text = ocr_futures[future]
+            try:
+                yield number, future.result()
+            except Exception as e:
+                print(f"Error running OCR on PDF page {number + 1}: {str(e)}")
+                yield number, text
+    finally:
+        for future in ocr_futures:
+            future.cancel()
+
+
+def extract_pdf_pages(path):
+    """Returns the text of every page in page order, or None if the file cannot be read.
+
+    PyMuPDF runs first since it is several times faster and can rasterize
+    scanned pages for OCR; PyPDF2 is the fallback for files it cannot open.
+    Pages stream into OCR as the text pass reaches them, but this collects
+    them all: every caller (document cache, entities, analysis) works on
+    the whole text.
+    """
+    try:
+        pages = dict(iter_pdf_pages_with_ocr(path))
+    except Exception as e:
+        print(f"Error extracting text from PDF with PyMuPDF: {str(e)}")
+        try:
+            pages = dict(iter_pdf_pages(path, "pypdf2"))
+        except Exception as e:
+            print(f"Error extracting text from PDF with PyPDF2: {str(e)}")
+            return None
+    return [pages[number] for number in sorted(pages)]
@@ -0,0 +1,486 @@
+import atexit
+import heapq
+import json
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: only one process writes the index there.
+    fcntl = None
+
+from cache import CACHE_DIR
+
+POLICY_INDEX_DIR = os.environ.get("POLICY_INDEX_DIR", os.path.join(CACHE_DIR, "policy_index"))
+# Chunks are windows of words with some overlap so a clause is never cut off from its context.
+POLICY_CHUNK_WORDS = int(os.environ.get("POLICY_CHUNK_WORDS", 200))
+POLICY_CHUNK_OVERLAP = int(os.environ.get("POLICY_CHUNK_OVERLAP", 40))
+POLICY_SEARCH_TOP_K = int(os.environ.get("POLICY_SEARCH_TOP_K", 4))
+# Uploads are batched into one segment per flush interval (or per this many policies).
+POLICY_INDEX_FLUSH_INTERVAL = float(os.environ.get("POLICY_INDEX_FLUSH_INTERVAL", 0.5))
+POLICY_SEGMENT_MAX_POLICIES = int(os.environ.get("POLICY_SEGMENT_MAX_POLICIES", 200))
+# Once there are more than this many segments, the smallest ones are merged into one.
+POLICY_MERGE_FACTOR = int(os.environ.get("POLICY_MERGE_FACTOR", 8))
+POLICY_MERGE_INTERVAL = float(os.environ.get("POLICY_MERGE_INTERVAL", 30))
+# Merged-away segment files are kept this long for searches that still hold an older snapshot.
+POLICY_SEGMENT_RETIRE_DELAY = float(os.environ.get("POLICY_SEGMENT_RETIRE_DELAY", 120))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have i if in into is it its my no not of on or "
+    "our so such that the their then there these they this to was we what when which will with "
+    "you your".split()
+)
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(text, words=POLICY_CHUNK_WORDS, overlap=POLICY_CHUNK_OVERLAP):
+    tokens = text.split()
+    step = max(words - overlap, 1)
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(" ".join(tokens[start:start + words]))
+        if start + words >= len(tokens):
+            break
+    return chunks
+
+
+def _create_segment_schema(conn):
+    conn.execute(
+        """CREATE TABLE chunks (
+            id INTEGER PRIMARY KEY,
+            chunk_id TEXT NOT NULL UNIQUE,
+            policy_id TEXT NOT NULL,
+            owner_uid TEXT,
+            policy_name TEXT,
+            position INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            length INTEGER NOT NULL
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE postings (
+            term TEXT NOT NULL,
+            chunk INTEGER NOT NULL,
+            tf INTEGER NOT NULL,
+            PRIMARY KEY (term, chunk)
+        ) WITHOUT ROWID"""
+    )
+    conn.execute(
+        """CREATE TABLE corpus_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            chunk_count INTEGER NOT NULL,
+            total_length INTEGER NOT NULL
+        )"""
+    )
+
+
+class Segment(namedtuple("Segment", "file seq chunk_count total_length")):
+    """An immutable SQLite file of chunks and postings. ``seq`` orders it against tombstones."""
+
+    def connect(self, directory):
+        path = os.path.join(directory, self.file)
+        return sqlite3.connect(f"file:{path}?immutable=1", uri=True, check_same_thread=False)
+
+
+# A search works on one snapshot from start to finish, so it never sees a half-applied update.
+IndexSnapshot = namedtuple("IndexSnapshot", "segments tombstones chunk_count total_length")
+
+
+class _Flush:
+    def __init__(self):
+        self.future = Future()
+
+
+class PolicyIndex:
+    """Segmented on-disk inverted index over policy document chunks, ranked with BM25.
+
+    Uploads are queued and written by a background thread as new immutable
+    segments; a policy that is replaced or removed gets a tombstone that hides
+    its chunks in older segments. manifest.json lists the live segments and
+    tombstones and is swapped atomically, so every search reads one consistent
+    snapshot. A second thread periodically merges the smallest segments and
+    drops dead chunks. Writers in several processes coordinate through a lock
+    file next to the manifest.
+
+    Like Lucene, document frequencies still count tombstoned chunks until
+    their segment is merged.
+    """
+
+    def __init__(self, directory=POLICY_INDEX_DIR):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._threads_lock = threading.Lock()
+        self._threads_started = False
+        self._merge_wakeup = threading.Event()
+        self._manifest_mtime = None
+        self._snapshot = IndexSnapshot((), {}, 0, 0)
+        self.snapshot()
+
+        self.published_segments = 0
+        self.last_freshness_lag = 0.0
+        self.max_freshness_lag = 0.0
+        self.merges = 0
+        self.merged_chunks = 0
+        self.last_merge_seconds = 0.0
+        self.total_merge_seconds = 0.0
+
+    # -- manifest -------------------------------------------------------------
+
+    @contextmanager
+    def _locked_manifest(self):
+        with self._manifest_lock, open(os.path.join(self.directory, "manifest.lock"), "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._read_manifest()
+            yield manifest
+            tmp_path = f"{self.manifest_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+            self._manifest_mtime = None
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"next_seq": 1, "segments": [], "tombstones": {}, "retired": []}
+
+    def snapshot(self):
+        # Other processes publish by replacing manifest.json; reload when it changes.
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return self._snapshot
+        if mtime != self._manifest_mtime:
+            manifest = self._read_manifest()
+            segments = tuple(Segment(**entry) for entry in manifest["segments"])
+            self._snapshot = IndexSnapshot(
+                segments,
+                manifest["tombstones"],
+                sum(segment.chunk_count for segment in segments),
+                sum(segment.total_length for segment in segments),
+            )
+            self._manifest_mtime = mtime
+        return self._snapshot
+
+    # -- writes ---------------------------------------------------------------
+
+    def _ensure_started(self):
+        with self._threads_lock:
+            if not self._threads_started:
+                threading.Thread(target=self._run_indexer, name="policy-indexer", daemon=True).start()
+                threading.Thread(target=self._run_merger, name="policy-merger", daemon=True).start()
+                self._threads_started = True
+
+    def add_policy(self, policy_id, owner_uid, name, text):
+        """Queues a policy for indexing, replacing any earlier version. Returns its chunk IDs."""
+        chunks = chunk_text(text)
+        self._ensure_started()
+        self._pending[policy_id] = owner_uid
+        self._queue.put(("add", policy_id, owner_uid, name, chunks, time.time()))
+        return [f"{policy_id}:{position}" for position in range(len(chunks))]
+
+    def remove_policy(self, policy_id):
+        self._ensure_started()
+        self._pending[policy_id] = None
+        self._queue.put(("remove", policy_id, None, None, None, time.time()))
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far is searchable."""
+        if not self._threads_started:
+            return
+        marker = _Flush()
+        self._queue.put(marker)
+        marker.future.result(timeout)
+
+    def _run_indexer(self):
+        while True:
+            item = self._queue.get()
+            ops = []
+            markers = []
+            deadline = time.monotonic() + POLICY_INDEX_FLUSH_INTERVAL
+            while True:
+                if isinstance(item, _Flush):
+                    markers.append(item)
+                    break
+                ops.append(item)
+                remaining = deadline - time.monotonic()
+                if len(ops) >= POLICY_SEGMENT_MAX_POLICIES or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if ops:
+                try:
+                    self._publish(ops)
+                except Exception as e:
+                    print(f"[PolicyIndex] Indexing {len(ops)} policies failed: {e}")
+            for marker in markers:
+                marker.future.set_result(None)
+
+    def _publish(self, ops):
+        # Only the last operation per policy in a batch matters.
+        latest = {}
+        for op in ops:
+            latest[op[1]] = op
+        adds = [op for op in latest.values() if op[0] == "add"]
+        segment = self._write_segment(adds) if adds else None
+        with self._locked_manifest() as manifest:
+            seq = manifest["next_seq"]
+            manifest["next_seq"] += 1
+            if segment:
+                manifest["segments"].append(segment._replace(seq=seq)._asdict())
+            for policy_id in latest:
+                manifest["tombstones"][policy_id] = seq
+        for policy_id, op in latest.items():
+            if self._pending.get(policy_id, op[2]) == op[2]:
+                self._pending.pop(policy_id, None)
+        self.snapshot()
+
+        lag = time.time() - min(op[5] for op in ops)
+        self.published_segments += 1
+        self.last_freshness_lag = lag
+        self.max_freshness_lag = max(self.max_freshness_lag, lag)
+        if len(manifest["segments"]) > POLICY_MERGE_FACTOR:
+            self._merge_wakeup.set()
+
+    def _write_segment(self, adds):
+        file = f"{uuid.uuid4().hex}.seg"
+        path = os.path.join(self.directory, file)
+        chunk_count = total_length = 0
+        conn = sqlite3.connect(f"{path}.tmp")
+        try:
+            _create_segment_schema(conn)
+            for _, policy_id, owner_uid, name, chunks, _ in adds:
+                for position, chunk in enumerate(chunks):
+                    terms = Counter(tokenize(chunk))
+                    length = sum(terms.values())
+                    row_id = conn.execute(
+                        "INSERT INTO chunks (chunk_id, policy_id, owner_uid, policy_name, position, text, length) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (f"{policy_id}:{position}", policy_id, owner_uid, name, position, chunk, length),
+                    ).lastrowid
+                    conn.executemany(
+                        "INSERT INTO postings (term, chunk, tf) VALUES (?, ?, ?)",
+                        [(term, row_id, tf) for term, tf in terms.items()],
+                    )
+                    chunk_count += 1
+                    total_length += length
+            conn.execute("INSERT INTO corpus_stats VALUES (1, ?, ?)", (chunk_count, total_length))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(f"{path}.tmp", path)
+        return Segment(file, 0, chunk_count, total_length)
+
+    # -- merging --------------------------------------------------------------
+
+    def _run_merger(self):
+        while True:
+            self._merge_wakeup.wait(POLICY_MERGE_INTERVAL)
+            self._merge_wakeup.clear()
+            try:
+                self.merge()
+            except Exception as e:
+                print(f"[PolicyIndex] Merge failed: {e}")
+
+    def merge(self):
+        """Merges the smallest segments once there are more than POLICY_MERGE_FACTOR of them."""
+        with open(os.path.join(self.directory, "merge.lock"), "a") as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # Another process is merging.
+            self.snapshot()
+            snapshot = self._snapshot
+            if len(snapshot.segments) <= POLICY_MERGE_FACTOR:
+                return
+            started = time.monotonic()
+            picked = sorted(snapshot.segments, key=lambda s: s.chunk_count)[:POLICY_MERGE_FACTOR]
+            merged = self._merge_segments(picked, snapshot.tombstones)
+            # New tombstones always get a seq above every existing segment, so taking the
+            # highest merged seq keeps every chunk on the right side of later deletes.
+            merged = merged._replace(seq=max(segment.seq for segment in picked))
+            picked_files = {segment.file for segment in picked}
+            now = time.time()
+            with self._locked_manifest() as manifest:
+                manifest["segments"] = [
+                    entry for entry in manifest["segments"] if entry["file"] not in picked_files
+                ] + [merged._asdict()]
+                min_seq = min(entry["seq"] for entry in manifest["segments"])
+                # A tombstone only hides chunks in segments older than itself.
+                manifest["tombstones"] = {
+                    policy_id: seq for policy_id, seq in manifest["tombstones"].items() if seq > min_seq
+                }
+                retired = manifest["retired"] + [{"file": file, "retired_at": now} for file in picked_files]
+                manifest["retired"] = []
+                for entry in retired:
+                    if now - entry["retired_at"] < POLICY_SEGMENT_RETIRE_DELAY:
+                        manifest["retired"].append(entry)
+                    else:
+                        try:
+                            os.remove(os.path.join(self.directory, entry["file"]))
+                        except FileNotFoundError:
+                            pass
+            self.snapshot()
+
+            elapsed = time.monotonic() - started
+            self.merges += 1
+            self.merged_chunks += merged.chunk_count
+            self.last_merge_seconds = elapsed
+            self.total_merge_seconds += elapsed
+            print(f"[PolicyIndex] Merged {len(picked)} segments ({merged.chunk_count} chunks) in {elapsed:.2f}s")
+
+    def _merge_segments(self, segments, tombstones):
+        file = f"{uuid.uuid4().hex}.seg"
+        path = os.path.join(self.directory, file)
+        conn = sqlite3.connect(f"{path}.tmp")
+        try:
+            _create_segment_schema(conn)
+            conn.execute("CREATE TEMP TABLE dead (policy_id TEXT PRIMARY KEY)")
+            offset = 0
+            for segment in segments:
+                conn.execute("DELETE FROM temp.dead")
+                conn.executemany(
+                    "INSERT INTO temp.dead VALUES (?)",
+                    [(policy_id,) for policy_id, seq in tombstones.items() if seq > segment.seq],
+                )
+                conn.execute("ATTACH DATABASE ? AS src", (f"file:{os.path.join(self.directory, segment.file)}?immutable=1",))
+                conn.execute(
+                    "INSERT INTO chunks SELECT id + ?, chunk_id, policy_id, owner_uid, policy_name, position, text, length "
+                    "FROM src.chunks WHERE policy_id NOT IN (SELECT policy_id FROM temp.dead)",
+                    (offset,),
+                )
+                conn.execute(
+                    "INSERT INTO postings SELECT p.term, p.chunk + ?, p.tf FROM src.postings p "
+                    "JOIN src.chunks c ON c.id = p.chunk WHERE c.policy_id NOT IN (SELECT policy_id FROM temp.dead)",
+                    (offset,),
+                )
+                conn.commit()
+                offset = conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()[0]
+                conn.execute("DETACH DATABASE src")
+            chunk_count, total_length = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+            ).fetchone()
+            conn.execute("INSERT INTO corpus_stats VALUES (1, ?, ?)", (chunk_count, total_length))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(f"{path}.tmp", path)
+        return Segment(file, 0, chunk_count, total_length)
+
+    # -- reads ----------------------------------------------------------------
+
+    def policy_owner(self, policy_id):
+        """Owner of a queued or indexed policy, or None if it is unknown or removed."""
+        if policy_id in self._pending:
+            return self._pending[policy_id]
+        snapshot = self.snapshot()
+        for segment in sorted(snapshot.segments, key=lambda s: s.seq, reverse=True):
+            if snapshot.tombstones.get(policy_id, 0) > segment.seq:
+                break
+            conn = segment.connect(self.directory)
+            try:
+                row = conn.execute(
+                    "SELECT owner_uid FROM chunks WHERE policy_id = ? LIMIT 1", (policy_id,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row:
+                return row[0]
+        return None
+
+    def search(self, query, k=POLICY_SEARCH_TOP_K, owner_uid=None):
+        """Returns the top-k chunks for the query, optionally limited to one owner's policies."""
+        terms = set(tokenize(query))
+        snapshot = self.snapshot()
+        if not terms or not snapshot.chunk_count:
+            return []
+        avg_length = snapshot.total_length / snapshot.chunk_count
+        connections = [segment.connect(self.directory) for segment in snapshot.segments]
+        try:
+            # df counts the whole corpus so scores do not depend on whose policies are searched.
+            df = Counter()
+            for conn in connections:
+                for term in terms:
+                    df[term] += conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+            scores = {}
+            for index, (segment, conn) in enumerate(zip(snapshot.segments, connections)):
+                for term in terms:
+                    if not df[term]:
+                        continue
+                    idf = math.log(1 + (snapshot.chunk_count - df[term] + 0.5) / (df[term] + 0.5))
+                    sql = ("SELECT p.chunk, p.tf, c.length, c.policy_id FROM postings p "
+                           "JOIN chunks c ON c.id = p.chunk WHERE p.term = ?")
+                    params = (term,)
+                    if owner_uid is not None:
+                        sql += " AND c.owner_uid = ?"
+                        params = (term, owner_uid)
+                    for row_id, tf, length, policy_id in conn.execute(sql, params):
+                        if snapshot.tombstones.get(policy_id, 0) > segment.seq:
+                            continue
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                        key = (index, row_id)
+                        scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            hits = []
+            for (index, row_id), score in top:
+                chunk_id, policy_id, name, position, text = connections[index].execute(
+                    "SELECT chunk_id, policy_id, policy_name, position, text FROM chunks WHERE id = ?",
+                    (row_id,),
+                ).fetchone()
+                hits.append({
+                    "chunk_id": chunk_id,
+                    "policy_id": policy_id,
+                    "policy_name": name,
+                    "position": position,
+                    "text": text,
+                    "score": round(score, 4),
+                })
+        finally:
+            for conn in connections:
+                conn.close()
+        return hits
+
+    def stats(self):
+        snapshot = self.snapshot()
+        return {
+            "segments": len(snapshot.segments),
+            "chunks": snapshot.chunk_count,
+            "tombstones": len(snapshot.tombstones),
+            "pending": self._queue.qsize(),
+            "published_segments": self.published_segments,
+            "last_freshness_lag_seconds": round(self.last_freshness_lag, 3),
+            "max_freshness_lag_seconds": round(self.max_freshness_lag, 3),
+            "merges": self.merges,
+            "merged_chunks": self.merged_chunks,
+            "last_merge_seconds": round(self.last_merge_seconds, 3),
+            "total_merge_seconds": round(self.total_merge_seconds, 3),
+        }
+
+
+policy_index = PolicyIndex()
+atexit.register(policy_index.flush, 30)
@@ -0,0 +1,59 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    The first caller for a key runs ``fn``; callers arriving while it is in
+    flight block and receive the same result (or exception). Nothing is kept
+    once the call finishes, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self.executed,
+                "shared": self.shared,
+            }
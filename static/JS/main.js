@@ -31,6 +31,37 @@ function formatResult(result) {
   return result;
 }
 
+async function readEventStream(response, onDelta) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let result = null;
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let eventName = 'message';
+      const dataLines = [];
+      rawEvent.split('\n').forEach((line) => {
+        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      });
+      if (!dataLines.length) continue;
+      const payload = JSON.parse(dataLines.join('\n'));
+      if (eventName === 'message') {
+        if (payload.delta) onDelta(payload.delta);
+      } else {
+        result = payload;
+      }
+    }
+  }
+  return result;
+}
+
 document.addEventListener('DOMContentLoaded', function () {
   document.querySelectorAll('.calc-form').forEach((form) => {
     form.addEventListener('submit', function (e) {
@@ -98,9 +129,20 @@ document.addEventListener('DOMContentLoaded', function () {
                   ).value,
                   result: roundedResult,
                   parameters: parameters,
+                  stream: true,
                 }),
               })
-                .then((res) => res.json())
+                .then((res) => {
+                  if (!(res.headers.get('Content-Type') || '').includes('text/event-stream')) {
+                    return res.json();
+                  }
+                  let streamed = '';
+                  return readEventStream(res, (delta) => {
+                    streamed += delta;
+                    explanationDiv.textContent = streamed.replace(/\*/g, '');
+                    explanationDiv.style.display = 'block';
+                  });
+                })
                 .then((data) => {
                   let cleanText = data.explanation.replace(/\*/g, '').trim();
                   explanationDiv.innerHTML = `
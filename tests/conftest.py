@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Modules create their SQLite files and directories under CACHE_DIR on import.
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="test-cache-"))
@@ -0,0 +1,26 @@
+from context_window import count_tokens, message_tokens, pack_messages
+
+
+def message(role, words):
+    return {"role": role, "content": " ".join(["word"] * words)}
+
+
+def test_history_fills_what_is_left_newest_first():
+    system = [message("system", 10)]
+    history = [message("user", 100), message("assistant", 100), message("user", 10), message("assistant", 10)]
+    packed = pack_messages(system, history, message("user", 10), budget=150)
+    assert packed == system + history[2:] + [message("user", 10)]
+
+
+def test_long_user_message_is_truncated_to_the_remaining_budget():
+    system = [message("system", 100)]
+    packed = pack_messages(system, [message("user", 10)], message("user", 2000), budget=1000)
+    assert packed[:-1] == system
+    assert sum(message_tokens(m) for m in packed) <= 1000
+    assert packed[-1]["content"].endswith("[...]")
+    assert count_tokens(packed[-1]["content"]) > 400
+
+
+def test_short_user_message_is_untouched():
+    user = message("user", 5)
+    assert pack_messages([], [], user, budget=100)[-1] is user
@@ -0,0 +1,37 @@
+import pytest
+
+# Pulls in health_assistant and its PDF/OCR dependencies.
+document_pipeline = pytest.importorskip("document_pipeline")
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    entries = {}
+    monkeypatch.setattr(document_pipeline.document_cache, "get", lambda digest: dict(entries.get(digest, {})))
+    monkeypatch.setattr(
+        document_pipeline.document_cache, "update",
+        lambda digest, **fields: entries.setdefault(digest, {}).update(fields),
+    )
+    return entries
+
+
+def test_empty_text_is_not_cached(cache, monkeypatch):
+    texts = iter(["   ", "Metformin 500 mg twice daily"])
+    monkeypatch.setattr(document_pipeline, "_extract_file_text", lambda upload: next(texts))
+    files = [{"path": "scan.png", "filename": "scan.png"}]
+
+    first = document_pipeline.process_upload(files, "abc")
+    assert first["doc_summary"].startswith("No text could be extracted")
+    assert "abc" not in cache
+
+    second = document_pipeline.process_upload(files, "abc")
+    assert "Metformin" in second["doc_summary"]
+    assert cache["abc"]["text"] == "Metformin 500 mg twice daily"
+
+
+def test_cached_summary_skips_extraction(cache, monkeypatch):
+    cache["abc"] = {"doc_summary": "Medication: aspirin"}
+    monkeypatch.setattr(document_pipeline, "_extract_file_text", lambda upload: pytest.fail("extracted again"))
+    assert document_pipeline.process_upload([{"path": "a.txt", "filename": "a.txt"}], "abc") == {
+        "doc_summary": "Medication: aspirin"
+    }
@@ -0,0 +1,59 @@
+import pytest
+
+import http_client
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = http_client.Upstream("test")
+    monkeypatch.setattr(upstream, "_backoff", lambda attempt, response=None: None)
+    upstream.calls = []
+
+    def respond(statuses):
+        statuses = iter(statuses)
+
+        def request(method, url, **kwargs):
+            upstream.calls.append(method)
+            return FakeResponse(next(statuses))
+        monkeypatch.setattr(upstream.session, "request", request)
+    upstream.respond = respond
+    return upstream
+
+
+def test_get_is_retried_on_server_errors(upstream):
+    upstream.respond([503, 502, 200])
+    assert upstream.request("GET", "http://upstream", retries=2).status_code == 200
+    assert upstream.calls == ["GET"] * 3
+
+
+def test_post_is_not_retried_on_server_errors(upstream):
+    upstream.respond([500, 200])
+    assert upstream.request("POST", "http://upstream", retries=2).status_code == 500
+    assert upstream.calls == ["POST"]
+
+
+def test_post_opts_in_to_server_error_retries(upstream):
+    upstream.respond([500, 200])
+    assert upstream.request("POST", "http://upstream", retries=2, idempotent=True).status_code == 200
+    assert len(upstream.calls) == 2
+
+
+def test_post_is_retried_when_rate_limited(upstream):
+    upstream.respond([429, 200])
+    assert upstream.request("POST", "http://upstream", retries=2).status_code == 200
+    assert len(upstream.calls) == 2
+
+
+def test_retries_run_out(upstream):
+    upstream.respond([503, 503, 503])
+    assert upstream.request("GET", "http://upstream", retries=1).status_code == 503
+    assert len(upstream.calls) == 2
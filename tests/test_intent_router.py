@@ -0,0 +1,61 @@
+from intent_router import (
+    CLAIM_STATUS,
+    COST_ESTIMATE,
+    COVERAGE_CHECK,
+    DOCUMENT_QUESTION,
+    INTENT_PHRASES,
+    IntentRouter,
+    NaiveBayesClassifier,
+)
+
+router = IntentRouter(INTENT_PHRASES)
+
+
+def test_single_intent():
+    assert router.route("how much is an MRI scan in Lagos?").intents >= {COST_ESTIMATE}
+    assert router.route("is physiotherapy covered by my HMO?").intents == {COVERAGE_CHECK}
+
+
+def test_claim_status_does_not_hide_other_intents():
+    assert router.route("my claim for the MRI cost is still pending").intents == {CLAIM_STATUS, COST_ESTIMATE}
+    assert router.route("claim for the physiotherapy coverage was denied").intents == {CLAIM_STATUS, COVERAGE_CHECK}
+
+
+def test_every_intent_in_one_message():
+    route = router.route("According to my lab report, what will it cost, does my plan cover it, and what is the status of my claim?")
+    assert route.intents == {COST_ESTIMATE, COVERAGE_CHECK, CLAIM_STATUS, DOCUMENT_QUESTION}
+
+
+def test_cover_needs_insurance_context():
+    assert COVERAGE_CHECK not in router.route("can you help with a cover letter for my job").intents
+    assert COVERAGE_CHECK in router.route("will my plan cover dental work?").intents
+    assert COVERAGE_CHECK in router.route("is this covered?").intents
+
+
+def test_extracts_references():
+    route = router.route("status of claim ref CLM-20931 on policy number HX-55821")
+    assert CLAIM_STATUS in route.intents
+    assert route.claim_ref == "CLM-20931"
+    assert route.policy_number == "HX-55821"
+
+
+def test_wants_policy_context():
+    assert router.route("what is the waiting period on my plan?").wants_policy_context
+    assert not router.route("how much does a blood test cost?").wants_policy_context
+
+
+def test_register_adds_intent():
+    custom = IntentRouter(INTENT_PHRASES)
+    custom.register("appointment", [r"appointments?", r"book(?:ing)?"])
+    assert custom.route("book an appointment and tell me the price").intents == {"appointment", COST_ESTIMATE}
+
+
+def test_classifier_only_runs_without_a_phrase_match():
+    classifier = NaiveBayesClassifier({
+        COST_ESTIMATE: ["what would the bill come to", "bill for surgery"],
+        "other": ["hello there", "thank you"],
+    })
+    with_classifier = IntentRouter(INTENT_PHRASES, classifier=classifier, threshold=0.5)
+    assert with_classifier.route("what would the bill come to").intents == {COST_ESTIMATE}
+    assert with_classifier.route("hello there").intents == frozenset()
+    assert with_classifier.route("is this covered?").intents == {COVERAGE_CHECK}
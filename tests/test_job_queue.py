@@ -0,0 +1,143 @@
+import os
+
+import job_queue as job_queue_module
+from job_queue import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+
+def make_queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"))
+
+
+def test_claims_oldest_job_once(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.enqueue("document_upload", {"digest": "a"})
+    second = queue.enqueue("document_upload", {"digest": "b"})
+
+    job = queue.claim("w1")
+    assert job["id"] == first
+    assert job["status"] == RUNNING and job["attempts"] == 1
+    assert job["payload"] == {"digest": "a"}
+    assert queue.claim("w2")["id"] == second
+    assert queue.claim("w3") is None
+
+
+def test_complete_and_fail(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("document_upload", {})
+    queue.claim("w1")
+    queue.fail(job_id, "w1", "boom")
+    assert queue.get(job_id)["status"] == QUEUED
+    assert queue.get(job_id)["error"] == "boom"
+
+    queue.claim("w1")
+    queue.complete(job_id, "w1", {"doc_summary": "ok"})
+    job = queue.get(job_id)
+    assert job["status"] == DONE and job["result"] == {"doc_summary": "ok"} and job["error"] is None
+
+
+def test_expired_lease_is_claimed_by_another_worker(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("document_upload", {})
+    monkeypatch.setattr(job_queue_module, "JOB_LEASE_SECONDS", -1)
+    queue.claim("w1")
+
+    job = queue.claim("w2")
+    assert job["id"] == job_id and job["worker"] == "w2" and job["attempts"] == 2
+    # The first worker lost its lease and can no longer settle the job.
+    assert not queue.heartbeat(job_id, "w1")
+    queue.complete(job_id, "w1", {})
+    assert queue.get(job_id)["status"] == RUNNING
+
+
+def test_live_lease_is_not_claimed_again(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("document_upload", {})
+    queue.claim("w1")
+    assert queue.claim("w2") is None
+    assert queue.heartbeat(job_id, "w1")
+
+
+def test_gives_up_after_max_attempts(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("document_upload", {})
+    monkeypatch.setattr(job_queue_module, "JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(job_queue_module, "JOB_LEASE_SECONDS", -1)
+    queue.claim("w1")
+    queue.claim("w2")
+    assert queue.claim("w3") is None
+    job = queue.get(job_id)
+    assert job["status"] == FAILED and "2 attempts" in job["error"]
+
+
+def test_stats(tmp_path):
+    queue = make_queue(tmp_path)
+    queue.enqueue("document_upload", {})
+    queue.enqueue("document_upload", {})
+    queue.claim("w1")
+    assert queue.stats()["counts"] == {QUEUED: 1, RUNNING: 1, DONE: 0, FAILED: 0}
+
+
+def test_same_dedupe_key_waits_for_the_running_job(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.enqueue("document_upload", {}, owner_uid="u1", dedupe_key="digest")
+    second = queue.enqueue("document_upload", {}, owner_uid="u2", dedupe_key="digest")
+    other = queue.enqueue("document_upload", {}, dedupe_key="other")
+
+    assert queue.claim("w1")["id"] == first
+    assert queue.claim("w2")["id"] == other
+    assert queue.claim("w3") is None
+    queue.complete(first, "w1", {})
+    assert queue.claim("w3")["id"] == second
+
+
+def test_find_active(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.enqueue("document_upload", {}, owner_uid="u1", dedupe_key="digest")
+    anonymous = queue.enqueue("document_upload", {}, dedupe_key="digest")
+    assert queue.find_active("document_upload", "digest", "u1") == job_id
+    assert queue.find_active("document_upload", "digest") == anonymous
+    assert queue.find_active("document_upload", "digest", "u2") is None
+
+    queue.claim("w1")
+    assert queue.find_active("document_upload", "digest", "u1") == job_id
+    queue.complete(job_id, "w1", {})
+    assert queue.find_active("document_upload", "digest", "u1") is None
+
+
+def write_job_file(queue, job_id, index):
+    path = queue.file_path(f"{job_id}-{index}", ".txt")
+    with open(path, "w") as f:
+        f.write("text")
+    return path
+
+
+def test_files_are_counted_until_the_job_finishes(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.new_id()
+    paths = [write_job_file(queue, job_id, index) for index in range(2)]
+    queue.enqueue("document_upload", {}, job_id=job_id, file_bytes=8)
+    assert queue.pending_file_bytes() == 8
+
+    queue.claim("w1")
+    assert queue.stats()["pending_file_bytes"] == 8
+    queue.complete(job_id, "w1", {})
+    assert queue.pending_file_bytes() == 0
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def test_files_are_kept_for_retries_and_removed_on_final_failure(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    monkeypatch.setattr(job_queue_module, "JOB_MAX_ATTEMPTS", 2)
+    job_id = queue.new_id()
+    path = write_job_file(queue, job_id, 0)
+    other = write_job_file(queue, queue.new_id(), 0)
+    queue.enqueue("document_upload", {}, job_id=job_id, file_bytes=4)
+
+    queue.claim("w1")
+    queue.fail(job_id, "w1", "boom")
+    assert os.path.exists(path)
+    queue.claim("w1")
+    queue.fail(job_id, "w1", "boom")
+    assert queue.get(job_id)["status"] == FAILED
+    assert not os.path.exists(path)
+    assert os.path.exists(other)
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from outbound_scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, SchedulerSaturated, UpstreamLimiter
+
+
+def start_waiter(limiter, priority, outcomes, name, timeout=5):
+    def wait():
+        try:
+            limiter.acquire(priority, timeout)
+        except SchedulerSaturated as e:
+            outcomes.append((name, e.status))
+        else:
+            outcomes.append((name, "granted"))
+
+    thread = threading.Thread(target=wait, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_admits_up_to_concurrency_without_queueing():
+    limiter = UpstreamLimiter("test", max_concurrency=2, max_queue=2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.stats()["active"] == 2
+    limiter.release()
+    limiter.release()
+    assert limiter.stats()["active"] == 0
+
+
+def test_released_slot_goes_to_highest_priority_then_oldest():
+    limiter = UpstreamLimiter("test", max_concurrency=1, max_queue=3)
+    limiter.acquire()
+    outcomes = []
+    threads = []
+    for name, priority in [("bulk", PRIORITY_BULK), ("first", PRIORITY_INTERACTIVE), ("second", PRIORITY_INTERACTIVE)]:
+        threads.append(start_waiter(limiter, priority, outcomes, name))
+        wait_for(lambda: limiter.queued == len(threads))
+
+    for expected in ["first", "second", "bulk"]:
+        limiter.release()
+        wait_for(lambda: len(outcomes) == 1)
+        assert outcomes.pop() == (expected, "granted")
+    limiter.release()
+    assert limiter.stats()["active"] == 0 and limiter.stats()["queued"] == 0
+
+
+def test_full_queue_rejects_with_429():
+    limiter = UpstreamLimiter("test", max_concurrency=1, max_queue=1)
+    limiter.acquire()
+    outcomes = []
+    thread = start_waiter(limiter, PRIORITY_INTERACTIVE, outcomes, "queued")
+    wait_for(lambda: limiter.queued == 1)
+
+    with pytest.raises(SchedulerSaturated) as e:
+        limiter.acquire(PRIORITY_INTERACTIVE, timeout=5)
+    assert e.value.status == 429 and e.value.retry_after >= 1
+    assert limiter.stats()["rejected"] == 1
+
+    limiter.release()
+    thread.join(2)
+    assert outcomes == [("queued", "granted")]
+
+
+def test_interactive_evicts_queued_bulk_work():
+    limiter = UpstreamLimiter("test", max_concurrency=1, max_queue=1)
+    limiter.acquire()
+    outcomes = []
+    bulk = start_waiter(limiter, PRIORITY_BULK, outcomes, "bulk")
+    wait_for(lambda: limiter.queued == 1)
+
+    interactive = start_waiter(limiter, PRIORITY_INTERACTIVE, outcomes, "interactive")
+    bulk.join(2)
+    assert outcomes == [("bulk", 429)]
+    # Bulk work cannot evict interactive work in turn.
+    with pytest.raises(SchedulerSaturated):
+        limiter.acquire(PRIORITY_BULK, timeout=5)
+
+    limiter.release()
+    interactive.join(2)
+    assert outcomes[-1] == ("interactive", "granted")
+
+
+def test_wait_past_deadline_fails_with_503():
+    limiter = UpstreamLimiter("test", max_concurrency=1, max_queue=1)
+    limiter.acquire()
+    with pytest.raises(SchedulerSaturated) as e:
+        limiter.acquire(PRIORITY_INTERACTIVE, timeout=0.05)
+    assert e.value.status == 503
+    stats = limiter.stats()
+    assert stats["timed_out"] == 1 and stats["queued"] == 0
+
+    # The expired waiter is skipped, so the slot is freed rather than handed to it.
+    limiter.release()
+    assert limiter.stats()["active"] == 0
+
+
+def test_slot_releases_on_error():
+    limiter = UpstreamLimiter("test", max_concurrency=1, max_queue=1)
+    with pytest.raises(ValueError):
+        with limiter.slot():
+            raise ValueError
+    assert limiter.stats()["active"] == 0
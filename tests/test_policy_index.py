@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import policy_index as policy_index_module
+from policy_index import PolicyIndex, chunk_text
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PolicyIndex(str(tmp_path / "index"))
+    # Merges only run when a test calls merge(), so results never depend on the background thread.
+    index._run_merger = lambda: None
+    return index
+
+
+def add(index, policy_id, owner_uid, text):
+    chunk_ids = index.add_policy(policy_id, owner_uid, f"{policy_id}.pdf", text)
+    index.flush(5)
+    return chunk_ids
+
+
+def policies(hits):
+    return [hit["policy_id"] for hit in hits]
+
+
+def test_chunks_overlap():
+    words = [f"w{n}" for n in range(10)]
+    assert chunk_text(" ".join(words), words=4, overlap=1) == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9"]
+
+
+def test_add_and_search(index):
+    assert add(index, "p1", "u1", "Physiotherapy sessions are covered up to ten visits a year.") == ["p1:0"]
+    add(index, "p2", "u1", "Dental cleaning is excluded from the basic plan.")
+
+    hits = index.search("physiotherapy visits")
+    assert policies(hits) == ["p1"]
+    assert hits[0]["chunk_id"] == "p1:0" and hits[0]["policy_name"] == "p1.pdf"
+    assert index.policy_owner("p1") == "u1"
+    assert index.stats()["segments"] == 2
+
+
+def test_search_is_limited_to_the_owner(index):
+    add(index, "p1", "u1", "Maternity care is covered after a waiting period.")
+    add(index, "p2", "u2", "Maternity care is not covered.")
+    assert sorted(policies(index.search("maternity"))) == ["p1", "p2"]
+    assert policies(index.search("maternity", owner_uid="u2")) == ["p2"]
+
+
+def test_replace_hides_the_old_version(index):
+    add(index, "p1", "u1", "Optical cover includes glasses every two years.")
+    add(index, "p1", "u1", "Hearing aids are covered once every five years.")
+    assert index.search("glasses") == []
+    assert policies(index.search("hearing aids")) == ["p1"]
+
+
+def test_remove(index):
+    add(index, "p1", "u1", "Ambulance transport is covered in emergencies.")
+    index.remove_policy("p1")
+    assert index.policy_owner("p1") is None
+    index.flush(5)
+    assert index.search("ambulance") == []
+    assert index.policy_owner("p1") is None
+
+
+def test_merge_drops_dead_chunks_and_keeps_results(index, monkeypatch):
+    monkeypatch.setattr(policy_index_module, "POLICY_MERGE_FACTOR", 3)
+    add(index, "p1", "u1", "Malaria treatment is covered in full.")
+    add(index, "p2", "u1", "Typhoid treatment is covered in full.")
+    add(index, "p3", "u1", "Cholera treatment is covered in full.")
+    add(index, "p2", "u1", "Typhoid treatment needs prior approval.")
+    index.remove_policy("p3")
+    index.flush(5)
+    before = index.search("treatment", k=10)
+    files_before = {segment.file for segment in index.snapshot().segments}
+    assert index.stats()["segments"] == 4 and index.stats()["chunks"] == 4
+
+    # The three oldest segments (p1, the first p2, p3) merge into one holding only p1.
+    index.merge()
+    stats = index.stats()
+    assert stats["merges"] == 1 and stats["merged_chunks"] == 1
+    assert stats["segments"] == 2 and stats["chunks"] == 2
+    assert sorted(policies(index.search("treatment", k=10))) == sorted(policies(before)) == ["p1", "p2"]
+    assert policies(index.search("approval")) == ["p2"]
+    assert index.search("cholera") == []
+    # Merged-away segments are retired, not deleted, while older snapshots may still read them.
+    assert all(os.path.exists(os.path.join(index.directory, file)) for file in files_before)
+
+
+def test_other_instances_see_published_segments(index):
+    add(index, "p1", "u1", "Vaccinations for children are covered.")
+    reader = PolicyIndex(index.directory)
+    assert policies(reader.search("vaccinations")) == ["p1"]
@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify
-import requests
+import http_client
 import os
 from dotenv import load_dotenv
 
@@ -28,7 +28,7 @@ def track_claim():
     if claim_ref:
         params['ref'] = claim_ref
 
-    response = requests.get(url, headers=HEADERS, params=params)
+    response = http_client.get("curacel", url, headers=HEADERS, params=params)
 
     if response.status_code == 200:
         claims = response.json()
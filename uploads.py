@@ -0,0 +1,131 @@
+import os
+import tempfile
+import threading
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, ServiceUnavailable
+
+from cache import CACHE_DIR
+
+# Whole request body; Werkzeug answers 413 before reading more than this.
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", 50 * 1024 * 1024))
+UPLOAD_MAX_FILE_BYTES = int(os.environ.get("UPLOAD_MAX_FILE_BYTES", 20 * 1024 * 1024))
+# Files stay in memory up to this size and spill to a temp file above it.
+UPLOAD_SPOOL_BYTES = int(os.environ.get("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+# Spilled upload bytes this process may hold on disk at once, across all requests;
+# upload files queued for the worker count against it too (see check_disk_budget).
+UPLOAD_MAX_DISK_BYTES = int(os.environ.get("UPLOAD_MAX_DISK_BYTES", 1024 * 1024 * 1024))
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR", os.path.join(CACHE_DIR, "uploads"))
+
+
+class UploadStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.peak_memory_bytes = 0
+        self.peak_disk_bytes = 0
+        self.spilled = 0
+        self.rejected = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "active": self.active,
+                "memory_bytes": self.memory_bytes,
+                "disk_bytes": self.disk_bytes,
+                "peak_memory_bytes": self.peak_memory_bytes,
+                "peak_disk_bytes": self.peak_disk_bytes,
+                "spilled": self.spilled,
+                "rejected": self.rejected,
+            }
+
+
+upload_stats = UploadStats()
+
+
+class UploadBuffer(tempfile.SpooledTemporaryFile):
+    """Spooled buffer for one uploaded file that enforces the size limits and keeps the gauges.
+
+    The spill file is anonymous, so nothing is left behind even if the
+    process dies; closing the buffer releases its share of the budgets.
+    """
+
+    def __init__(self):
+        super().__init__(max_size=UPLOAD_SPOOL_BYTES, dir=UPLOAD_TMP_DIR)
+        self.size = 0
+        self._on_disk = False
+        self._released = False
+        with upload_stats.lock:
+            upload_stats.active += 1
+
+    def write(self, data):
+        size = self.size + len(data)
+        if size > UPLOAD_MAX_FILE_BYTES:
+            self._reject()
+            raise RequestEntityTooLarge(f"Files are limited to {UPLOAD_MAX_FILE_BYTES // (1024 * 1024)} MB")
+        with upload_stats.lock:
+            on_disk = upload_stats.disk_bytes + size - (self.size if self._on_disk else 0)
+            over_budget = (self._on_disk or size > UPLOAD_SPOOL_BYTES) and on_disk > UPLOAD_MAX_DISK_BYTES
+        if over_budget:
+            self._reject()
+            raise ServiceUnavailable("Too many uploads in progress, try again shortly")
+        written = super().write(data)
+        with upload_stats.lock:
+            if self._on_disk:
+                upload_stats.disk_bytes += size - self.size
+            elif self._rolled:
+                self._on_disk = True
+                upload_stats.spilled += 1
+                upload_stats.memory_bytes -= self.size
+                upload_stats.disk_bytes += size
+            else:
+                upload_stats.memory_bytes += size - self.size
+            upload_stats.peak_memory_bytes = max(upload_stats.peak_memory_bytes, upload_stats.memory_bytes)
+            upload_stats.peak_disk_bytes = max(upload_stats.peak_disk_bytes, upload_stats.disk_bytes)
+        self.size = size
+        return written
+
+    def _reject(self):
+        # A rejected buffer never reaches request.files, so release it here rather than at teardown.
+        with upload_stats.lock:
+            upload_stats.rejected += 1
+        self.close()
+
+    def close(self):
+        with upload_stats.lock:
+            if not self._released:
+                self._released = True
+                upload_stats.active -= 1
+                if self._on_disk:
+                    upload_stats.disk_bytes -= self.size
+                else:
+                    upload_stats.memory_bytes -= self.size
+        super().close()
+
+
+def check_disk_budget(extra_bytes, held_elsewhere=0):
+    """Raises ServiceUnavailable if extra_bytes more on disk would pass UPLOAD_MAX_DISK_BYTES.
+
+    held_elsewhere is disk the gauges do not see, e.g. job files waiting for a worker.
+    """
+    with upload_stats.lock:
+        over_budget = upload_stats.disk_bytes + held_elsewhere + extra_bytes > UPLOAD_MAX_DISK_BYTES
+        if over_budget:
+            upload_stats.rejected += 1
+    if over_budget:
+        raise ServiceUnavailable("Too many uploads in progress, try again shortly")
+
+
+class UploadRequest(Request):
+    """Request class that parses uploaded files into UploadBuffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadBuffer()
+
+
+def init_app(app):
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    app.request_class = UploadRequest
+    app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_BYTES
@@ -0,0 +1,88 @@
+"""Background worker for queued jobs (document uploads).
+
+Start as many as the host has cores for, e.g. ``python worker.py`` per
+process or the Procfile ``worker`` entry scaled out. Each worker runs one
+job at a time and keeps its lease alive while it works; if a worker dies,
+its job is picked up again once the lease expires.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import document_pipeline
+from job_queue import JOB_LEASE_SECONDS, job_queue
+
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 1))
+JOB_PURGE_INTERVAL = 3600
+# Longest pause between retries while the queue database is unavailable (e.g. locked).
+JOB_ERROR_BACKOFF_MAX = float(os.environ.get("JOB_ERROR_BACKOFF_MAX", 30))
+
+HANDLERS = {
+    "document_upload": document_pipeline.run_upload_job,
+}
+
+
+def _keep_lease(job_id, worker, stop):
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            renewed = job_queue.heartbeat(job_id, worker)
+        except sqlite3.Error as e:
+            # The lease has time left; try again on the next beat.
+            print(f"[Worker] Could not renew the lease on job {job_id}: {e}")
+            continue
+        if not renewed:
+            print(f"[Worker] Lost the lease on job {job_id}")
+            return
+
+
+def _record(settle, job, *args):
+    try:
+        settle(job["id"], *args)
+    except sqlite3.Error as e:
+        # The lease runs out unrenewed and another attempt picks the job up.
+        print(f"[Worker] Could not record the outcome of job {job['id']}: {e}")
+
+
+def run(worker):
+    print(f"[Worker] {worker} started")
+    last_purge = 0
+    errors = 0
+    while True:
+        try:
+            if time.time() - last_purge > JOB_PURGE_INTERVAL:
+                job_queue.purge()
+                last_purge = time.time()
+            job = job_queue.claim(worker)
+        except (sqlite3.Error, OSError) as e:
+            errors += 1
+            delay = min(JOB_POLL_INTERVAL * 2 ** errors, JOB_ERROR_BACKOFF_MAX)
+            print(f"[Worker] Job queue unavailable, retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            continue
+        errors = 0
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        stop = threading.Event()
+        threading.Thread(target=_keep_lease, args=(job["id"], worker, stop), daemon=True).start()
+        started = time.monotonic()
+        try:
+            result = HANDLERS[job["kind"]](job["payload"])
+        except Exception as e:
+            print(f"[Worker] Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {e}")
+            _record(job_queue.fail, job, worker, str(e))
+        else:
+            _record(job_queue.complete, job, worker, result)
+            print(f"[Worker] Job {job['id']} ({job['kind']}) done in {time.monotonic() - started:.2f}s")
+        finally:
+            stop.set()
+
+
+if __name__ == "__main__":
+    run(f"{socket.gethostname()}:{os.getpid()}")